@@ -0,0 +1,192 @@
+import os
+import sys
+import glob
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from run_analyses import run_analyses
+
+
+def read_manifest(config):
+    """Function to list the networks of a batch
+    Parameters
+    config: dictionary with either
+        networks: glob pattern of gml files, the community file of each network is the
+        json file with the same name
+        manifest: json file with a list of {"network_file": ..., "community_file": ...} entries
+
+    Returns
+    jobs: list of dictionaries with the network and community file of each network
+    """
+    if "manifest" in config:
+        with open(config["manifest"], 'r') as f:
+            return json.load(f)
+    jobs = []
+    for network_file in sorted(glob.glob(config["networks"])):
+        jobs.append({"network_file": network_file,
+                     "community_file": os.path.splitext(network_file)[0] + ".json"})
+    return jobs
+
+
+def finished_networks(output_file):
+    """Function to read the networks already analysed in a previous run
+    Parameters
+    output_file: jsonl file with one result record per network
+
+    Returns
+    finished: set with the network files of the successful records
+    """
+    finished = set()
+    if not os.path.exists(output_file):
+        return finished
+    with open(output_file, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Line left incomplete by an interrupted run
+                continue
+            if record.get("status") == "ok":
+                finished.add(record["network_file"])
+    return finished
+
+
+def run_job(job):
+    """Function to run the analyses of one network of the batch
+    Parameters
+    job: tuple with the network entry and the configuration of the analyses
+
+    Returns
+    record: dictionary with the results of the network or the error raised
+    """
+    entry, config = job
+    network_config = dict(config, path="", network_file=entry["network_file"],
+                          community_file=entry.get("community_file"))
+    record = {"network_file": entry["network_file"], "community_file": entry.get("community_file")}
+    start = time.time()
+    try:
+        record["results"] = run_analyses(network_config)
+        record["status"] = "ok"
+    except Exception as error:
+        record["status"] = "error"
+        record["error"] = f"{type(error).__name__}: {error}"
+    record["elapsed"] = time.time() - start
+    return record
+
+
+def error_record(entry, error):
+    """Function to build the record of a network that could not be analysed
+    Parameters
+    entry: dictionary with the network and community file of the network
+    error: description of the error
+
+    Returns
+    record: dictionary with the error, skipped by finished_networks so the network is retried
+    """
+    return {"network_file": entry["network_file"], "community_file": entry.get("community_file"),
+            "status": "error", "error": error, "elapsed": 0.0}
+
+
+def pool_records(jobs, n_workers):
+    """Generator over the records of the jobs of a process pool as they finish.
+    A worker terminated abruptly, e.g. killed for lack of memory, breaks the pool and
+    every job that had not finished is then yielded without record
+    Parameters
+    jobs: list of jobs as taken by run_job
+    n_workers: number of processes
+
+    Yields
+    job: the job
+    record: its record from run_job, None if it was lost with a terminated worker
+    """
+    with ProcessPoolExecutor(n_workers) as executor:
+        futures = {executor.submit(run_job, job): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except BrokenProcessPool:
+                yield futures[future], None
+
+
+def run_batch(config):
+    """Function to run the analyses over many networks with a pool of processes.
+    The largest networks are scheduled first and every finished network is appended
+    to the output file at once, networks already in it are skipped
+    Parameters
+    config: dictionary with the configuration of run_analyses.run_analyses, without the
+    network and community files, plus
+        networks or manifest: networks of the batch, see read_manifest
+        output_file: jsonl file with one record per network
+        n_workers: number of processes, each one analyses a different network
+
+    Missing network files and networks whose worker process was terminated get an error
+    record instead of stopping the batch. A terminated worker breaks the whole pool, so the
+    networks that had not finished are run again one at a time, and only the network that
+    terminates its worker again gets the error record
+
+    Returns
+    n_done: number of networks recorded in this run
+    """
+    output_file = config["output_file"]
+    n_workers = config.get("n_workers", os.cpu_count())
+
+    finished = finished_networks(output_file)
+    entries = [entry for entry in read_manifest(config) if entry["network_file"] not in finished]
+    missing = [entry for entry in entries if not os.path.exists(entry["network_file"])]
+    entries = [entry for entry in entries if os.path.exists(entry["network_file"])]
+    # Largest graphs first, so that they do not end up alone at the end of the run
+    entries.sort(key=lambda entry: os.path.getsize(entry["network_file"]), reverse=True)
+
+    analyses_config = {key: value for key, value in config.items()
+                       if key not in ("networks", "manifest", "output_file", "n_workers")}
+    # The networks already fill the workers, the randomized graphs run in the worker of each network
+    analyses_config["polarization"] = dict(analyses_config.get("polarization", {}), n_workers=1)
+    if "entropy_null_model" in analyses_config:
+        analyses_config["entropy_null_model"] = dict(analyses_config["entropy_null_model"], n_workers=1)
+
+    # Make sure a record left incomplete by an interrupted run does not merge with a new one
+    if os.path.exists(output_file) and os.path.getsize(output_file) > 0:
+        with open(output_file, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            complete = f.read(1) == b"\n"
+        if not complete:
+            with open(output_file, 'a') as f:
+                f.write("\n")
+
+    n_done = 0
+    with open(output_file, 'a') as out:
+        def write(record):
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+
+        for entry in missing:
+            write(error_record(entry, f"FileNotFoundError: {entry['network_file']}"))
+            n_done += 1
+
+        lost = []
+        for job, record in pool_records([(entry, analyses_config) for entry in entries], n_workers):
+            if record is None:
+                lost.append(job)
+                continue
+            write(record)
+            n_done += 1
+
+        for job in lost:
+            for _, record in pool_records([job], 1):
+                if record is None:
+                    record = error_record(job[0], "BrokenProcessPool: the worker process was terminated abruptly")
+                write(record)
+                n_done += 1
+    return n_done
+
+
+def main(config_file):
+    # Read configuration file
+    with open(config_file, 'r') as f:
+        config = json.load(f)
+    return run_batch(config)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
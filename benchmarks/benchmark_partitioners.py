@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+# The benchmarks run from the repository root or from this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from generators import two_block_sbm  # noqa: E402
+from graph_cache import load_graph  # noqa: E402
+from partitioners import PARTITIONERS, partition_graph  # noqa: E402
+from polarization import METRIC_NAMES, block_contingency, contingency_metrics, process_graph  # noqa: E402
+
+
+def polarization_scores(graph, parts):
+    """Function to calculate the polarization metrics of a bisection as polarization.calculate_polarization_metrics"""
+    return dict(zip(METRIC_NAMES, contingency_metrics(block_contingency(graph, parts))))
+
+
+def benchmark_partitioners(graph, methods=None, repeats=3, seed=0):
+    """Function to time every partitioner on the same graph and score its bisection
+    Parameters
+    graph: CSRGraph, processed as in polarization.run_polarization
+    methods: names of the partitioners, all of PARTITIONERS by default
+    repeats: number of timed runs of each partitioner, the fastest one is reported
+    seed: seed passed to the partitioners
+
+    Returns
+    results: dictionary with the partitioners as keys and their time, metrics and
+    agreement with the first partitioner as values
+    """
+    graph = process_graph(graph)
+    methods = list(methods or PARTITIONERS)
+    results = {}
+    reference = None
+    for method in methods:
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            parts = partition_graph(graph, method=method, seed=seed)
+            times.append(time.perf_counter() - start)
+        if reference is None:
+            reference = parts
+        # Labels of the two parts are arbitrary
+        agreement = max(np.mean(parts == reference), np.mean(parts != reference))
+        results[method] = {"seconds": min(times), "agreement": float(agreement)}
+        results[method].update(polarization_scores(graph, parts))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runtime and polarization metrics of each partitioner")
+    parser.add_argument("network_files", nargs="*", help="gml networks, a planted bisection is generated if none is given")
+    parser.add_argument("--nodes", type=int, default=100000, help="nodes of the generated graph")
+    parser.add_argument("--degree", type=float, default=10, help="mean degree of the generated graph")
+    parser.add_argument("--mixing", type=float, default=0.1, help="fraction of edges between the generated communities")
+    parser.add_argument("--methods", nargs="*", default=None, help="partitioners to compare, all by default")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs of each partitioner")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generator and the partitioners")
+    parser.add_argument("--output", default=None, help="json file for the results")
+    args = parser.parse_args()
+
+    if args.network_files:
+        inputs = {network_file: load_graph(network_file) for network_file in args.network_files}
+    else:
+        name = f"planted_n{args.nodes}_k{args.degree:g}_mu{args.mixing:g}"
+        graph, _ = two_block_sbm(int(args.nodes*args.degree/2), homophily=1 - args.mixing,
+                                 mean_degree=args.degree, seed=args.seed)
+        inputs = {name: graph}
+
+    all_results = {}
+    for name, graph in inputs.items():
+        results = benchmark_partitioners(graph, methods=args.methods, repeats=args.repeats, seed=args.seed)
+        all_results[name] = results
+        print(name)
+        print(f"{'partitioner':<12} {'seconds':>9} {'agreement':>9} {'modularity':>10} {'conductance':>11} "
+              f"{'ei_index':>9} {'ei_ext':>9}")
+        for method, result in results.items():
+            print(f"{method:<12} {result['seconds']:>9.4f} {result['agreement']:>9.3f} {result['modularity']:>10.4f} "
+                  f"{result['conductance']:>11.4f} {result['ei_index']:>9.4f} {result['ei_index_extended']:>9.4f}")
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(all_results, f, indent=1)
+    return all_results
+
+
+if __name__ == '__main__':
+    main()
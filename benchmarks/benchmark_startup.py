@@ -0,0 +1,135 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("networkx", "scipy", "metis", "pandas", "matplotlib")
+
+# Code run in a fresh interpreter for every measurement: it times the import of the
+# entry point and its first call on a small generated network, and prints the result as json
+MEASURE = """
+import sys, time, json
+sys.path.insert(0, {root!r})
+sys.path.insert(0, {benchmarks!r})
+start = time.perf_counter()
+import {module}
+import_seconds = time.perf_counter() - start
+imported = [name for name in {heavy!r} if name in sys.modules]
+from generators import retweet_graph
+graph, modules = retweet_graph(2000, seed=0)
+start = time.perf_counter()
+{call}
+first_call_seconds = time.perf_counter() - start
+print(json.dumps({{"import_seconds": import_seconds, "first_call_seconds": first_call_seconds,
+                  "heavy_modules_at_import": imported}}))
+"""
+
+# Code run in a fresh interpreter to load a gml network through the binary cache, it prints
+# the heavy modules loaded by the call. The second run reads the cache written by the first
+CACHE_LOAD = """
+import sys, json
+sys.path.insert(0, {root!r})
+from graph_cache import load_graph
+load_graph({network_file!r}, cache_dir={cache_dir!r})
+print(json.dumps([name for name in {heavy!r} if name in sys.modules]))
+"""
+
+# Small network written as gml text, so that the check does not need networkx in this process
+CACHE_NETWORK = "graph [\n" + "".join(f'  node [ id {i} label "{i}" ]\n' for i in range(4)) + \
+    "".join(f"  edge [ source {i} target {(i + 1) % 4} ]\n" for i in range(4)) + "]\n"
+
+# First call of each entry point, with the network in graph and the communities in modules
+ENTRY_POINTS = {
+    "polarization": "polarization.run_polarization(graph, n_replicates=1, seed=0)",
+    "entropy": "entropy.run_entropy(graph, modules)",
+    "chamber_analysis": "chamber_analysis.run_chamber(graph, modules, [0, 1], 10)",
+    "run_analyses": "run_analyses.run_analyses({'analyses': ['polarization', 'entropy', 'chamber'], "
+                    "'polarization': {'n_replicates': 1, 'seed': 0}, 'relevant_communities': [0, 1], "
+                    "'number_of_top_users': 10}, G=graph, modules=modules)",
+    "batch_analyses": "batch_analyses.read_manifest({'networks': 'none*.gml'})",
+    "streaming_polarization": "list(streaming_polarization.stream_polarization("
+                              "[(0.0, 'a', 'b', 1.0), (1.0, 'b', 'c', 1.0), (2.0, 'c', 'd', 1.0)], 2, 1))",
+}
+
+
+def measure_startup(module, call, repeats=5):
+    """Function to measure the import time and first call latency of an entry point,
+    each repetition in a new interpreter
+    Parameters
+    module: name of the module of the entry point
+    call: code of its first call
+    repeats: number of interpreters started
+
+    Returns
+    result: dictionary with the median import and first call times, the median wall time of the
+    whole process, from the start of the interpreter to its exit, and the heavy modules already
+    loaded after the import
+    """
+    code = MEASURE.format(root=ROOT, benchmarks=os.path.join(ROOT, "benchmarks"), module=module,
+                          heavy=HEAVY_MODULES, call=call)
+    runs = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        run = json.loads(output.stdout.strip().splitlines()[-1])
+        run["process_seconds"] = time.perf_counter() - start
+        runs.append(run)
+    return {"import_seconds": statistics.median(run["import_seconds"] for run in runs),
+            "first_call_seconds": statistics.median(run["first_call_seconds"] for run in runs),
+            "process_seconds": statistics.median(run["process_seconds"] for run in runs),
+            "heavy_modules_at_import": runs[-1]["heavy_modules_at_import"],
+            "repeats": repeats}
+
+
+def check_cache_hit():
+    """Function to check that loading a network from a warm cache does not import networkx
+    Returns
+    imported: list with the heavy modules loaded by the cache hit, networkx must not be in it
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        network_file = os.path.join(directory, "network.gml")
+        with open(network_file, 'w') as f:
+            f.write(CACHE_NETWORK)
+        code = CACHE_LOAD.format(root=ROOT, network_file=network_file, cache_dir=os.path.join(directory, "cache"),
+                                 heavy=HEAVY_MODULES)
+        # The first run parses the gml file and writes the cache, the second one reads it
+        subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time and first call latency of every entry point")
+    parser.add_argument("--entry-points", nargs="*", default=None, choices=sorted(ENTRY_POINTS),
+                        help="entry points to measure, all by default")
+    parser.add_argument("--repeats", type=int, default=5, help="interpreters started per entry point")
+    parser.add_argument("--output", default=None, help="json file for the results")
+    args = parser.parse_args()
+
+    results = {}
+    for module in args.entry_points or ENTRY_POINTS:
+        results[module] = measure_startup(module, ENTRY_POINTS[module], repeats=args.repeats)
+        result = results[module]
+        print(f"{module:<24} import {result['import_seconds']:.3f} s  first call {result['first_call_seconds']:.3f} s  "
+              f"process {result['process_seconds']:.3f} s  "
+              f"loaded at import: {', '.join(result['heavy_modules_at_import']) or '-'}", flush=True)
+
+    cache_hit_modules = check_cache_hit()
+    results["cache_hit"] = {"heavy_modules": cache_hit_modules}
+    print(f"{'cache hit':<24} loaded: {', '.join(cache_hit_modules) or '-'}", flush=True)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if "networkx" in cache_hit_modules:
+        sys.exit("Loading a network from a warm cache imported networkx")
+    return results
+
+
+if __name__ == '__main__':
+    main()
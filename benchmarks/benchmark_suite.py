@@ -0,0 +1,175 @@
+import os
+import sys
+import gc
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from generators import retweet_graph, two_block_sbm  # noqa: E402
+from graph_arrays import degrees, node_flows  # noqa: E402
+from polarization import calculate_polarization_metrics, configuration_edges, generate_configuration_graph  # noqa: E402
+from entropy import get_community_entropy, get_community_flow_matrix, get_community_network  # noqa: E402
+from chamber_analysis import get_audience, get_chamber, get_chamber_overlap, top_k_indices  # noqa: E402
+
+
+def setup_polarization(n_edges, seed):
+    graph, modules = two_block_sbm(n_edges, homophily=0.9, seed=seed)
+    return {"graph": graph, "modules": modules, "degree_sequence": degrees(graph)}
+
+
+def setup_communities(n_edges, seed, n_top_users=200):
+    graph, modules = retweet_graph(n_edges, seed=seed)
+    flows = node_flows(graph)
+    # Audience of the users with the highest inflow, as in chamber_analysis.run_chamber
+    top_users = [flows["nodes"][node] for node in top_k_indices(flows["in_strength"], n_top_users)]
+    audience = get_audience(graph, dict.fromkeys(top_users, 1))
+    chamber = get_chamber(graph, audience)
+    return {"graph": graph, "modules": modules, "community_graph": get_community_flow_matrix(graph, modules),
+            "audience": audience, "chamber": chamber}
+
+
+# Hot functions: the generator whose inputs they take and the call to time.
+# networkx marks the functions building networkx objects, limited to smaller sizes
+BENCHMARKS = {
+    "calculate_polarization_metrics": ("sbm", lambda d: calculate_polarization_metrics(d["graph"], None, d["modules"]), False),
+    "configuration_edges": ("sbm", lambda d: configuration_edges(d["degree_sequence"], seed=0), False),
+    "generate_configuration_graph": ("sbm", lambda d: generate_configuration_graph(d["degree_sequence"], d["graph"].nodes, seed=0), True),
+    "get_community_network": ("retweet", lambda d: get_community_network(d["graph"], d["modules"]), False),
+    "get_community_entropy": ("retweet", lambda d: get_community_entropy(d["community_graph"]), False),
+    "get_chamber": ("retweet", lambda d: get_chamber(d["graph"], d["audience"]), False),
+    "get_chamber_overlap": ("retweet", lambda d: get_chamber_overlap(d["chamber"]), False),
+}
+
+SETUPS = {"sbm": setup_polarization, "retweet": setup_communities}
+
+
+def measure(function, data, repeats=3):
+    """Function to measure the wall time and the peak memory of a call
+    Parameters
+    function: function taking the benchmark data
+    data: dictionary with the inputs of the function
+    repeats: number of timed calls, the fastest one is reported
+
+    Returns
+    seconds: wall time of the fastest call
+    peak_bytes: peak of the memory allocated during a separate traced call
+    """
+    times = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        function(data)
+        times.append(time.perf_counter() - start)
+
+    # Tracing slows the call down, so memory is measured apart from time
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function(data)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), peak_bytes
+
+
+def run_suite(sizes, functions=None, repeats=3, seed=0, networkx_max_edges=10**6, on_result=None):
+    """Function to run the benchmarks of the hot functions over graphs of increasing size
+    Parameters
+    sizes: list with the number of edges of the generated graphs
+    functions: names of the benchmarks to run, all of BENCHMARKS by default
+    repeats: number of timed calls of each function
+    seed: seed of the generators
+    networkx_max_edges: largest size for the functions building networkx objects
+    on_result: optional function called with every result
+
+    Returns
+    results: list of dictionaries with the function, generator, number of edges,
+    wall time and peak memory of every benchmark
+    """
+    functions = list(functions or BENCHMARKS)
+    results = []
+    for n_edges in sizes:
+        for generator in SETUPS:
+            selected = [name for name in functions if BENCHMARKS[name][0] == generator
+                        and not (BENCHMARKS[name][2] and n_edges > networkx_max_edges)]
+            if not selected:
+                continue
+            start = time.perf_counter()
+            data = SETUPS[generator](n_edges, seed)
+            setup_seconds = time.perf_counter() - start
+            for name in selected:
+                seconds, peak_bytes = measure(BENCHMARKS[name][1], data, repeats=repeats)
+                result = {"function": name, "generator": generator, "n_edges": n_edges,
+                          "n_nodes": len(data["graph"].nodes), "seconds": seconds,
+                          "peak_bytes": peak_bytes, "setup_seconds": setup_seconds}
+                results.append(result)
+                if on_result is not None:
+                    on_result(result)
+            del data
+    return results
+
+
+def compare(results, baseline):
+    """Function to compare the results with those of a previous run
+    Parameters
+    results: list of results from run_suite
+    baseline: list of results of the previous run
+
+    Returns
+    comparison: list of dictionaries with the function, number of edges and the ratios
+    of time and memory with respect to the baseline, above 1 when slower or larger
+    """
+    previous = {(result["function"], result["n_edges"]): result for result in baseline}
+    comparison = []
+    for result in results:
+        key = (result["function"], result["n_edges"])
+        if key in previous:
+            comparison.append({"function": result["function"], "n_edges": result["n_edges"],
+                               "time_ratio": result["seconds"]/previous[key]["seconds"],
+                               "memory_ratio": result["peak_bytes"]/max(previous[key]["peak_bytes"], 1)})
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wall time and peak memory of the hot functions on synthetic graphs")
+    parser.add_argument("--sizes", type=float, nargs="*", default=[1e3, 1e4, 1e5, 1e6],
+                        help="number of edges of the generated graphs, up to 1e7")
+    parser.add_argument("--functions", nargs="*", default=None, choices=sorted(BENCHMARKS),
+                        help="functions to benchmark, all by default")
+    parser.add_argument("--repeats", type=int, default=3, help="timed calls of each function")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generators")
+    parser.add_argument("--networkx-max-edges", type=float, default=1e6,
+                        help="largest size for the functions building networkx graphs")
+    parser.add_argument("--output", default="benchmark_results.json", help="json file for the results")
+    parser.add_argument("--compare", default=None, help="json file of a previous run to compare with")
+    args = parser.parse_args()
+
+    def report(result):
+        print(f"{result['function']:<32} {result['n_edges']:>10} edges {result['seconds']:>10.4f} s "
+              f"{result['peak_bytes']/2**20:>10.1f} MiB", flush=True)
+
+    results = run_suite([int(size) for size in args.sizes], functions=args.functions, repeats=args.repeats,
+                        seed=args.seed, networkx_max_edges=int(args.networkx_max_edges), on_result=report)
+    output = {"meta": {"date": datetime.now(timezone.utc).isoformat(), "python": platform.python_version(),
+                       "numpy": np.__version__, "machine": platform.machine(), "processor": platform.processor(),
+                       "seed": args.seed, "repeats": args.repeats},
+              "results": results}
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)["results"]
+        for row in compare(results, baseline):
+            print(f"{row['function']:<32} {row['n_edges']:>10} edges time x{row['time_ratio']:.2f} "
+                  f"memory x{row['memory_ratio']:.2f}")
+    return output
+
+
+if __name__ == '__main__':
+    main()
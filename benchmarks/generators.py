@@ -0,0 +1,87 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from graph_arrays import csr_from_edges  # noqa: E402
+
+
+def two_block_sbm(n_edges, homophily=0.9, mean_degree=10, seed=None, directed=False):
+    """Function to generate a stochastic block model with two communities of equal size
+    Parameters
+    n_edges: number of edges
+    homophily: fraction of the edges inside a community, 0.5 gives no community structure
+    mean_degree: expected degree of the nodes, sets the number of nodes
+    seed: seed of the generator
+    directed: if True the graph is directed
+
+    Returns
+    graph: CSRGraph with nodes labelled by their index, multi-edges and self-loops may appear
+    modules: dictionary with nodes as keys and the community (0 or 1) as value
+    """
+    rng = np.random.default_rng(seed)
+    n_nodes = max(2, int(round((1 if directed else 2)*n_edges/mean_degree)))
+    half = n_nodes//2
+    sources = rng.integers(0, n_nodes, size=n_edges)
+    between = rng.random(n_edges) >= homophily
+    # Targets in the half of the source, or in the other half for the edges between communities
+    own_start = np.where(sources < half, 0, half)
+    own_size = np.where(sources < half, half, n_nodes - half)
+    other_start = half - own_start
+    other_size = n_nodes - own_size
+    start = np.where(between, other_start, own_start)
+    size = np.where(between, other_size, own_size)
+    targets = start + (rng.random(n_edges)*size).astype(np.int64)
+
+    graph = csr_from_edges(sources, targets, None, range(n_nodes), directed=directed)
+    modules = dict(enumerate((np.arange(n_nodes) >= half).astype(int).tolist()))
+    return graph, modules
+
+
+def retweet_graph(n_edges, n_communities=8, homophily=0.8, mean_degree=10, exponent=2.1, seed=None):
+    """Function to generate a directed retweet-like network between several communities.
+    Users have heavy-tailed activity and popularity, drawn from a Pareto law, and retweet
+    mostly users of their own community. Repeated retweets are merged into the edge weight
+    Parameters
+    n_edges: number of retweets before merging repetitions
+    n_communities: number of communities, their sizes decrease as 1/rank
+    homophily: fraction of the retweets inside the community of the retweeter
+    mean_degree: expected out-degree of the users, sets the number of users
+    exponent: exponent of the Pareto law of activity and popularity, heavier tails when closer to 1
+    seed: seed of the generator
+
+    Returns
+    graph: directed and weighted CSRGraph with nodes labelled by their index
+    modules: dictionary with nodes as keys and the community as value
+    """
+    rng = np.random.default_rng(seed)
+    n_nodes = max(n_communities, int(round(n_edges/mean_degree)))
+    community_weight = 1/np.arange(1, n_communities + 1)
+    community = np.sort(rng.choice(n_communities, size=n_nodes, p=community_weight/community_weight.sum()))
+
+    activity = rng.pareto(exponent - 1, size=n_nodes) + 1
+    popularity = rng.pareto(exponent - 1, size=n_nodes) + 1
+    cumulative_activity = np.cumsum(activity)
+    # Nodes are sorted by community, so the popularity of a community is a slice of the cumulative sum
+    cumulative_popularity = np.cumsum(popularity)
+    community_end = np.searchsorted(community, np.arange(n_communities), side="right")
+    community_start = np.concatenate([[0], community_end[:-1]])
+    popularity_before = np.concatenate([[0], cumulative_popularity])
+
+    sources = np.searchsorted(cumulative_activity, rng.random(n_edges)*cumulative_activity[-1], side="right")
+    inside = rng.random(n_edges) < homophily
+    source_community = community[sources]
+    low = np.where(inside, popularity_before[community_start[source_community]], 0)
+    high = np.where(inside, popularity_before[community_end[source_community]], cumulative_popularity[-1])
+    targets = np.searchsorted(cumulative_popularity, low + rng.random(n_edges)*(high - low), side="right")
+    targets = np.minimum(targets, n_nodes - 1)
+
+    keep = sources != targets
+    pair_keys, counts = np.unique(sources[keep].astype(np.int64)*n_nodes + targets[keep], return_counts=True)
+    sources, targets = np.divmod(pair_keys, n_nodes)
+    graph = csr_from_edges(sources, targets, counts, range(n_nodes), directed=True)
+    modules = dict(enumerate(community.tolist()))
+    return graph, modules
+
+
+GENERATORS = {"sbm": two_block_sbm, "retweet": retweet_graph}
@@ -1,9 +1,12 @@
-import os
-import subprocess
-import glob
 import sys
-import networkx as nx
 import json
+import numpy as np
+from scipy import sparse
+from graph_cache import load_graph
+from edge_store import EdgeStore, store_node_flows
+from instrumentation import NULL_RECORDER, Recorder, print_progress
+from graph_arrays import adjacency_matrix, as_csr, node_flows, node_positions, nodes_dict
+from communities import CommunityAssignment, as_assignment
 
 def top_n_keys(input_dict, top_entries):
     """
@@ -23,51 +26,80 @@ def top_n_keys(input_dict, top_entries):
 
     return top_n_dict
 
-def get_community_size(community_info):
+def top_k_indices(values,k):
     """
-    Function to transform the dictionary of nodes and communities to a dictionary with communities and their size
+    Function to select the k largest values without sorting all of them.
+    Ties are broken by position, as a stable sort would do
     Parameters
-    community_info: dictionary with nodes as keys and communities as values
+    values: array of values
+    k: number of values to keep
 
     Returns
-    community_counts: dictionary with communities as keys as size as values
-
+    indices: array with the indices of the k largest values in decreasing order of value
     """
-    community_counts = {}
-    for community in community_info.values():
-        if community_counts.get(community,"error")!="error":
-            community_counts[community] += 1
-        else:
-            community_counts[community] = 1
-
-    return community_counts
-
-def get_topusers_community(modules,node_inflow,number_top_users):
+    values=np.asarray(values)
+    if k<=0:
+        return np.empty(0,dtype=np.int64)
+    if len(values)>k:
+        # Value of the k-th largest element, found in linear time
+        threshold=np.partition(values,len(values)-k)[len(values)-k]
+        above=np.flatnonzero(values>threshold)
+        ties=np.flatnonzero(values==threshold)[:k-len(above)]
+        selected=np.concatenate([above,ties])
+    else:
+        selected=np.arange(len(values))
+    return selected[np.lexsort((selected,-values[selected]))]
+
+def get_topusers_community(modules,node_inflow,number_top_users,flows=None):
     """
-    Function to transform the dictionary of nodes and communities to a dictionary with communities and their size
-    :param modules:
-    :param module_size
-    :param top_users
+    Function to select the users with the highest inflow of each of the 100 largest communities
+    :param modules: dictionary with nodes as keys and communities as values, or CommunityAssignment
+    :param node_inflow: dictionary with nodes as keys and inflow as value, not used if flows is given
+    :param number_top_users: number of users kept per community
+    :param flows: optional dictionary of arrays from graph_arrays.node_flows, the inflow
+    is then read from its in_strength array
 
     :return
     Returns
-    community_counts: dictionary with communities as keys as size as values
+    user_dict: dictionary with the selected users with positive inflow as keys and their inflow as values
 
     """
+    users=list(modules)
+    if isinstance(modules,CommunityAssignment):
+        codes=modules.key_codes
+        module_size=modules.sizes
+    else:
+        # Communities encoded in order of first appearance
+        community_index={}
+        codes=np.fromiter((community_index.setdefault(community,len(community_index)) for community in modules.values()),
+                          dtype=np.int64,count=len(users))
+        module_size=np.bincount(codes,minlength=len(community_index))
+    in_top=np.zeros(len(module_size),dtype=bool)
+    in_top[top_k_indices(module_size,100)]=True
+
+    if flows is None:
+        has_inflow=np.fromiter((user in node_inflow for user in users),dtype=bool,count=len(users))
+        inflow=np.fromiter((node_inflow.get(user,0) for user in users),dtype=np.float64,count=len(users))
+    else:
+        # Position of each user in the flow arrays, -1 for users not in the graph
+        if isinstance(modules,CommunityAssignment) and modules.aligned(flows["nodes"]):
+            positions=modules.key_positions
+        else:
+            positions=node_positions(flows["node_index"],users)
+        has_inflow=positions>=0
+        inflow=np.where(has_inflow,flows["in_strength"][positions],0)
+    candidates=np.flatnonzero(has_inflow&in_top[codes])
+
+    # Group the candidates by community, groups in order of their first candidate
+    order=candidates[np.argsort(codes[candidates],kind="stable")]
+    boundaries=np.flatnonzero(np.diff(codes[order]))+1
+    groups=sorted(np.split(order,boundaries),key=lambda group:group[0]) if len(order)>0 else []
+
     user_dict={}
-    community_dict={}
-    module_size=get_community_size(modules)
-    module_size=top_n_keys(module_size,100)
-    for user in modules:
-        if node_inflow.get(user,"error")!="error":
-            if module_size.get(modules[user],"error")!="error":
-                community_dict[modules[user]]=community_dict.setdefault(modules[user],{})
-                community_dict[modules[user]][user]=node_inflow[user]
-    for community in community_dict:
-        community_dict[community]=top_n_keys(community_dict[community], number_top_users)
-        for user in community_dict[community]:
-            if node_inflow[user]>0:
-                user_dict[user]=node_inflow[user]
+    for group in groups:
+        for user in group[top_k_indices(inflow[group],number_top_users)]:
+            if inflow[user]>0:
+                user_dict[users[user]]=node_inflow[users[user]] if flows is None else float(inflow[user])
     return user_dict
 
 def get_reversed_graph(graph):
@@ -79,6 +111,8 @@ def get_reversed_graph(graph):
     Returns
     graph_reversed: reversed graph where source are now targets and viceversa
     """
+    import networkx as nx
+
     # new reversed graph object
     graph_reversed = nx.DiGraph()
 
@@ -90,22 +124,21 @@ def get_reversed_graph(graph):
 def get_inflow(graph):
     """Function to calculate the total inflow and outdegree of users
     Parameters
-    graph: networkx graph object
+    graph: networkx graph object, CSRGraph or EdgeStore, read by chunks
 
     Returns
     total_inflow: dictionary with nodes as keys and inflow as value
     indegree_dict: dictionary with nodes as keys and indegree as value
     """
+    if isinstance(graph, EdgeStore):
+        flows = store_node_flows(graph)
+    else:
+        graph = as_csr(graph)
+        flows = node_flows(graph)
     # calculate total inflow for each node
-    total_inflow = {}
-    for node in graph.nodes():
-        inflow = sum(data['weight'] for _, _, data in graph.in_edges(node, data=True))
-        total_inflow[node] = inflow
+    total_inflow = nodes_dict(graph, flows["in_strength"])
     # Calculate the indegree of the nodes
-    indegree_dict = {}
-    for node in graph.nodes():
-        indegree = graph.in_degree(node)
-        indegree_dict[node] = indegree
+    indegree_dict = nodes_dict(graph, flows["in_degree"])
     return indegree_dict,total_inflow
 
 def dictionary_overlap(dict1, dict2):
@@ -129,25 +162,73 @@ def dictionary_overlap(dict1, dict2):
 def get_outflow(graph):
     """Function to calculate the total outflow and out degree of users
     Parameters
-    graph: networkx graph object
+    graph: networkx graph object, CSRGraph or EdgeStore, read by chunks
 
     Returns
     total_outflow: dictionary with nodes as keys and outflow as value
     outdegree_dict: dictionary with nodes as keys and outdegree as value
     """
-    # calculate total inflow for each node
-    total_outflow = {}
-    for node in graph.nodes():
-        outflow = sum(data['weight'] for _, _, data in graph.out_edges(node, data=True))
-        total_outflow[node] = outflow
-    # Calculate the indegree of the nodes
-    outdegree_dict = {}
-    for node in graph.nodes():
-        outdegree = graph.out_degree(node)
-        outdegree_dict[node] = outdegree
+    if isinstance(graph, EdgeStore):
+        flows = store_node_flows(graph)
+    else:
+        graph = as_csr(graph)
+        flows = node_flows(graph)
+    # calculate total outflow for each node
+    total_outflow = nodes_dict(graph, flows["out_strength"])
+    # Calculate the outdegree of the nodes
+    outdegree_dict = nodes_dict(graph, flows["out_degree"])
 
     return outdegree_dict,total_outflow
 
+def get_chamber_incidence(input_user_chamber):
+    """
+    Function to build the sparse incidence matrix between users and the members of their chambers
+    Parameters
+    input_user_chamber: dictionary with the user as keys and the chamber dictionary as value
+
+    Returns
+    users: sorted list of users, one per row
+    incidence: sparse boolean matrix with a one if the member (column) is in the chamber of the user (row)
+    """
+    users = sorted(input_user_chamber)
+    member_index = {}
+    lengths = np.fromiter((len(input_user_chamber[user]) for user in users), dtype=np.int64, count=len(users))
+    columns = np.fromiter((member_index.setdefault(member, len(member_index))
+                           for user in users for member in input_user_chamber[user]),
+                          dtype=np.int64, count=lengths.sum())
+    indptr = np.concatenate([[0], np.cumsum(lengths)])
+    incidence = sparse.csr_matrix((np.ones(len(columns), dtype=np.int32), columns, indptr),
+                                  shape=(len(users), len(member_index)))
+    return users, incidence
+
+def get_chamber_overlap_matrix(incidence):
+    """
+    Function to calculate the Jaccard overlap between the chambers of all pairs of users
+    Parameters
+    incidence: sparse user x member incidence matrix as returned by get_chamber_incidence
+
+    Returns
+    overlap: dense users x users matrix with the chamber overlap
+    """
+    # Count with integers, boolean products would saturate at one
+    incidence = sparse.csr_matrix(incidence, dtype=np.int32)
+    # Intersections from the product of the incidence matrix with itself, unions from the chamber sizes
+    intersection = (incidence @ incidence.T).toarray().astype(np.float64)
+    sizes = np.asarray(incidence.sum(axis=1), dtype=np.float64).ravel()
+    union = sizes[:, None] + sizes[None, :] - intersection
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return intersection/union
+
+def overlap_matrix_to_dict(users,overlap):
+    """
+    Function to turn the overlap matrix into a dictionary with the overlap of each pair of users,
+    each pair appearing once with the users in the order given
+    """
+    chamber_overlap_dict={}
+    for i1,user in enumerate(users):
+        chamber_overlap_dict[user]=dict(zip(users[i1+1:],overlap[i1,i1+1:].tolist()))
+    return chamber_overlap_dict
+
 def get_chamber_overlap(input_user_chamber):
     """
     Function to calculate the chamber overlap between users
@@ -158,31 +239,72 @@ def get_chamber_overlap(input_user_chamber):
     Returns
     chamber_overlap_dict: dictionary with the chamber overlap between users
     """
-    chamber_overlap_dict={}
-    for i1,user in enumerate(sorted(input_user_chamber)):
-        chamber_overlap_dict[user]={}
-        for i2,user1 in enumerate(sorted(input_user_chamber)):
-            if user!=user1 and i1<i2:
-                overlap_value=dictionary_overlap(input_user_chamber[user],input_user_chamber[user1])
-                chamber_overlap_dict[user][user1]=overlap_value
+    users, incidence = get_chamber_incidence(input_user_chamber)
+    overlap = get_chamber_overlap_matrix(incidence)
 
-    return chamber_overlap_dict
+    return overlap_matrix_to_dict(users,overlap)
+
+def selector_matrix(graph,rows):
+    """
+    Function to build the sparse matrix selecting some nodes of the graph
+    Parameters
+    graph: CSRGraph object
+    rows: list with the integer index of the selected nodes
+
+    Return
+    selector: sparse matrix with a one in the column of each selected node, one row per node
+    """
+    return sparse.csr_matrix((np.ones(len(rows),dtype=np.int8),(np.arange(len(rows)),rows)),
+                             shape=(len(rows),len(graph.nodes)))
+
+def get_chamber_matrix(graph,users,recorder=NULL_RECORDER,with_chamber=True):
+    """
+    Function to calculate the audience and the chamber of several users at once.
+    With A the adjacency matrix and S the selector of the users, the audience is S·Aᵀ
+    and the chamber is S·Aᵀ·A
+
+    Parameters
+    graph: networkx graph object or CSRGraph
+    users: list of users
+    recorder: optional instrumentation.Recorder of the audience and chamber stages
+    with_chamber: if False only the audience is calculated, skipping the second product
+
+    Return
+    audience: sparse boolean users x nodes matrix with the audience of each user
+    chamber: sparse boolean users x nodes matrix with the chamber of each user, None if
+    with_chamber is False
+    """
+    graph=as_csr(graph)
+    adjacency=adjacency_matrix(graph,binary=True)
+    selector=selector_matrix(graph,[graph.node_index[user] for user in users])
+    # The transpose is a CSC view of the same arrays, no reversed copy of the graph is built
+    with recorder.stage("audience") as stage:
+        audience=(selector@adjacency.T).tocsr().astype(bool)
+        stage["items"]=len(users)
+    if not with_chamber:
+        return audience,None
+    with recorder.stage("chamber") as stage:
+        chamber=(audience.astype(np.int32)@adjacency).astype(bool)
+        stage["items"]=len(users)
+    return audience,chamber
 
 def get_audience(graph,user_dict):
     """
     Function to calculate the audience of each user
 
     Parameters
-    graph: networkx graph object
+    graph: networkx graph object or CSRGraph
 
     Return
     user_audience: dictionary with users as keys and the dictionary of audience as values
     """
-    graph_reversed=get_reversed_graph(graph)
+    graph=as_csr(graph)
+    users=[user for user in graph.nodes if user_dict.get(user,"error")!="error"]
+    audience,_=get_chamber_matrix(graph,users,with_chamber=False)
     user_audience={}
-    for user in graph.nodes():
-        if user_dict.get(user,"error")!="error":
-            user_audience[user]=list(graph_reversed[user].keys())
+    for row,user in enumerate(users):
+        members=audience.indices[audience.indptr[row]:audience.indptr[row+1]]
+        user_audience[user]=[graph.nodes[node] for node in members]
     return user_audience
 
 def get_chamber(graph,audience):
@@ -190,22 +312,74 @@ def get_chamber(graph,audience):
     Function to calculate the chamber of each user
 
     Parameters
-    graph: networkx graph object
+    graph: networkx graph object or CSRGraph
     audience: dictionary with users as keys and the audience as a value dictionary
 
     Return
     user_chamber: dictionary with users as keys and the dictionary of chamber as values
     """
+    graph=as_csr(graph)
+    users=list(audience)
+    lengths=[len(audience[user]) for user in users]
+    members=[graph.node_index[member] for user in users for member in audience[user]]
+    audience_matrix=sparse.csr_matrix((np.ones(len(members),dtype=np.int32),(np.repeat(np.arange(len(users)),lengths),members)),
+                                      shape=(len(users),len(graph.nodes)))
+    chamber=audience_matrix@adjacency_matrix(graph,binary=True)
+    chamber.sort_indices()
 
     user_chamber={}
-    for user in audience:
-        for member in audience[user]:
-            for target in graph[member]:
-                user_chamber[user]=user_chamber.setdefault(user,{})
-                user_chamber[user][target]=1
+    for row,user in enumerate(users):
+        targets=chamber.indices[chamber.indptr[row]:chamber.indptr[row+1]]
+        if len(targets)>0:
+            user_chamber[user]=dict.fromkeys([graph.nodes[node] for node in targets],1)
     return user_chamber
 
 
+def run_chamber(G,modules,relevant_communities,number_of_top_users,approximate_overlap=None,recorder=NULL_RECORDER):
+    """Function to calculate the chamber overlap between the top users of the relevant communities
+    Parameters
+    G: networkx graph object or CSRGraph
+    modules: dictionary with nodes as keys and communities as values, or CommunityAssignment
+    relevant_communities: list of communities to be considered in the chamber overlap
+    number_of_top_users: number of users with the highest inflow kept per community
+    approximate_overlap: optional dictionary with the parameters of
+    chamber_minhash.approximate_chamber_overlap (epsilon, delta, threshold, seed), if given
+    the overlaps are estimated with MinHash signatures instead of computed exactly
+    recorder: optional instrumentation.Recorder of the top users, audience, chamber and overlap stages
+
+    Returns
+    results: dictionary with the inflow of the selected top users and their chamber overlap
+    """
+    G = as_csr(G)
+    modules = as_assignment(G, modules)
+    with recorder.stage("top_users") as stage:
+        # Calculate node degree and flow
+        flows = node_flows(G)
+        # Dictionary with top users per community
+        top_user_dict = get_topusers_community(modules,None,number_of_top_users,flows=flows)
+        stage["items"] = len(top_user_dict)
+
+    # Filter the node inflow according to the top users
+    filtered_top_user_dict = {node: inflow for node, inflow in top_user_dict.items() if modules.get(node) in relevant_communities}
+
+    # Calculate the audience and the chamber of all the top users at once
+    users = sorted(filtered_top_user_dict)
+    user_audience, user_chamber = get_chamber_matrix(G,users,recorder=recorder)
+    # Calculate chamber overlap between the users with a non-empty chamber
+    with recorder.stage("overlap",approximate=approximate_overlap is not None) as stage:
+        with_chamber = np.flatnonzero(user_chamber.getnnz(axis=1)>0)
+        users_with_chamber = [users[row] for row in with_chamber]
+        if approximate_overlap is None:
+            overlap = get_chamber_overlap_matrix(user_chamber[with_chamber])
+            chamber_overlap = overlap_matrix_to_dict(users_with_chamber,overlap)
+        else:
+            from chamber_minhash import approximate_chamber_overlap
+            chamber_overlap = approximate_chamber_overlap(users_with_chamber,user_chamber[with_chamber],**approximate_overlap)
+        stage["items"] = len(users_with_chamber)
+
+    return {"top_users":filtered_top_user_dict
+            ,"chamber_overlap":chamber_overlap}
+
 def main(input_file):
 
     # Read configuration file
@@ -222,7 +396,15 @@ def main(input_file):
     community_file = config["community_file"]
     ## Define the main opposed communities
     relevant_communities = config["relevant_communities"]
-    G = nx.read_gml(f"{FILE_PATH}{network_file}")
+    # Optional log of the time and memory of every stage, as in run_analyses
+    recorder=NULL_RECORDER
+    if config.get("log_file") is not None or config.get("progress"):
+        recorder=Recorder(log_file=config.get("log_file"),progress=print_progress if config.get("progress") else None)
+
+    # Binary graph cache shared with the other scripts
+    with recorder.stage("load") as stage:
+        G = load_graph(f"{FILE_PATH}{network_file}",cache_dir=config.get("cache_dir"))
+        stage["items"] = len(G.nodes)
 
 
     # Open the JSON file
@@ -230,26 +412,14 @@ def main(input_file):
         # Read the JSON data
         modules = json.load(f)
 
-    # Calculate node degree and flow
-    node_indegree,node_inflow = get_inflow(G)
-    node_outdegree,node_outflow = get_outflow(G)
-    # Dictionary with top users per community
+    # Top users to consider per community
     number_of_top_users = config["number_of_top_users"]
-    # Top communities to consider
-
-    top_user_dict = get_topusers_community(modules,node_inflow,number_of_top_users)
-
-    # Filter the node inflow according to the top users
-    filtered_top_user_dict = {node: inflow for node, inflow in top_user_dict.items() if modules.get(node) in relevant_communities}
 
-    # Calculate user audience
-    user_audience = get_audience(G,filtered_top_user_dict)
-    print ("passed_audience")
-    # Calculate user chamber
-    user_chamber = get_chamber(G,user_audience)
-    print ("passed user chamber")
-    # Calculate chamber overlap
-    chamber_overlap = get_chamber_overlap(user_chamber)
+    try:
+        return run_chamber(G,modules,relevant_communities,number_of_top_users,
+                           approximate_overlap=config.get("approximate_overlap"),recorder=recorder)
+    finally:
+        recorder.close()
 
 if __name__ == '__main__':
 
@@ -0,0 +1,165 @@
+import math
+import numpy as np
+
+# Mersenne prime of the universal hash functions h(x) = (a*x + b) mod p, products fit in 64 bits
+HASH_PRIME = (1 << 31) - 1
+
+
+def num_perm_for_error(epsilon, delta=0.05):
+    """Function to choose the length of the MinHash signatures.
+    By Hoeffding's inequality the estimated overlap of any pair is within epsilon
+    of the exact one with probability at least 1-delta
+    Parameters
+    epsilon: maximum absolute error of the estimated overlap
+    delta: probability of exceeding the error
+
+    Returns
+    num_perm: number of hash functions
+    """
+    return int(math.ceil(math.log(2/delta)/(2*epsilon**2)))
+
+
+def minhash_signatures(incidence, num_perm=128, seed=0, chunk_size=16, block_entries=1 << 18):
+    """Function to calculate the MinHash signature of the chamber of each user
+    Parameters
+    incidence: sparse user x member incidence matrix, e.g. from get_chamber_incidence or get_chamber_matrix
+    num_perm: number of hash functions, the length of the signatures
+    seed: seed of the hash functions, signatures are only comparable with the same seed
+    chunk_size: number of hash functions evaluated at once
+    block_entries: number of chamber entries hashed at once, the temporary memory is bounded
+    by chunk_size*block_entries hashes whatever the number of entries of the incidence
+
+    Returns
+    signatures: users x num_perm array with the minimum hash of each chamber, empty
+    chambers get HASH_PRIME
+    """
+    from scipy import sparse
+
+    incidence = sparse.csr_matrix(incidence)
+    if incidence.shape[1] >= HASH_PRIME:
+        raise ValueError("Too many chamber members for the 31 bit hash functions")
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, HASH_PRIME, size=num_perm, dtype=np.int64)
+    b = rng.integers(0, HASH_PRIME, size=num_perm, dtype=np.int64)
+
+    signatures = np.full((incidence.shape[0], num_perm), HASH_PRIME, dtype=np.int64)
+    n_entries = incidence.indptr[-1]
+    # The entries are hashed by blocks, a chamber split between two blocks takes the minimum of both
+    for start in range(0, n_entries, block_entries):
+        stop = min(start + block_entries, n_entries)
+        members = incidence.indices[start:stop].astype(np.int64)
+        first_row = np.searchsorted(incidence.indptr, start, side="right") - 1
+        last_row = np.searchsorted(incidence.indptr, stop, side="left")
+        # Segments of the rows of the block, empty rows give no segment as reduceat needs
+        bounds = np.clip(incidence.indptr[first_row:last_row + 1], start, stop) - start
+        rows = np.arange(first_row, last_row)[bounds[1:] > bounds[:-1]]
+        starts = bounds[:-1][bounds[1:] > bounds[:-1]]
+        for first in range(0, num_perm, chunk_size):
+            last = min(first + chunk_size, num_perm)
+            hashes = (a[first:last, None]*members[None, :] + b[first:last, None]) % HASH_PRIME
+            signatures[rows, first:last] = np.minimum(signatures[rows, first:last],
+                                                      np.minimum.reduceat(hashes, starts, axis=1).T)
+    return signatures
+
+
+def minhash_overlap(signatures):
+    """Function to estimate the Jaccard overlap between all pairs of users from their signatures
+    Parameters
+    signatures: users x num_perm array from minhash_signatures
+
+    Returns
+    overlap: dense users x users matrix with the estimated chamber overlap
+    """
+    n_users, num_perm = signatures.shape
+    matches = np.zeros((n_users, n_users), dtype=np.int32)
+    for column in signatures.T:
+        matches += column[:, None] == column[None, :]
+    return matches/num_perm
+
+
+def lsh_bands(num_perm, threshold):
+    """Function to choose the number of bands and rows per band of the LSH index.
+    Pairs with overlap s become candidates with probability 1-(1-s^rows)^bands, whose
+    steepest point (1/bands)^(1/rows) is taken as close as possible to the threshold
+    Parameters
+    num_perm: length of the signatures
+    threshold: overlap above which pairs are wanted
+
+    Returns
+    bands: number of bands
+    rows: number of rows of each band
+    """
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm//rows
+        error = abs((1/bands)**(1/rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+def lsh_candidate_pairs(signatures, threshold, bands=None, rows=None):
+    """Function to find the pairs of users likely to have an overlap above a threshold
+    with locality sensitive hashing of the signature bands
+    Parameters
+    signatures: users x num_perm array from minhash_signatures
+    threshold: overlap above which pairs are wanted
+    bands, rows: optional banding of the signatures, chosen from the threshold by default
+
+    Returns
+    pairs: array with one row (i, j), i < j, per candidate pair of users
+    """
+    if bands is None or rows is None:
+        bands, rows = lsh_bands(signatures.shape[1], threshold)
+
+    candidates = []
+    for band in range(bands):
+        band_signatures = signatures[:, band*rows:(band + 1)*rows]
+        _, bucket = np.unique(band_signatures, axis=0, return_inverse=True)
+        bucket = bucket.ravel()
+        # Users sharing a bucket, grouped by sorting on the bucket
+        order = np.argsort(bucket, kind="stable")
+        sorted_bucket = bucket[order]
+        boundaries = np.flatnonzero(np.diff(sorted_bucket)) + 1
+        for group in np.split(order, boundaries):
+            if len(group) > 1:
+                i, j = np.triu_indices(len(group), k=1)
+                candidates.append(np.stack([group[i], group[j]], axis=1))
+    if not candidates:
+        return np.empty((0, 2), dtype=np.int64)
+    pairs = np.sort(np.concatenate(candidates), axis=1)
+    return np.unique(pairs, axis=0)
+
+
+def approximate_chamber_overlap(users, incidence, epsilon=0.05, delta=0.05, threshold=None, seed=0):
+    """Function to estimate the chamber overlap between users with MinHash signatures
+    Parameters
+    users: list of users, one per row of incidence
+    incidence: sparse user x member incidence matrix
+    epsilon: maximum absolute error of the estimated overlaps
+    delta: probability of exceeding the error for a given pair
+    threshold: if given, only the pairs found by LSH with an estimated overlap of at least
+    threshold are returned
+    seed: seed of the hash functions
+
+    Returns
+    chamber_overlap_dict: dictionary with the estimated chamber overlap between users,
+    as get_chamber_overlap
+    """
+    signatures = minhash_signatures(incidence, num_perm=num_perm_for_error(epsilon, delta), seed=seed)
+
+    chamber_overlap_dict = {user: {} for user in users}
+    if threshold is None:
+        overlap = minhash_overlap(signatures)
+        for i1, user in enumerate(users):
+            chamber_overlap_dict[user] = dict(zip(users[i1 + 1:], overlap[i1, i1 + 1:].tolist()))
+        return chamber_overlap_dict
+
+    # Band for a lower threshold, so that pairs just above it are not missed because of the estimation error
+    bands, rows = lsh_bands(signatures.shape[1], max(threshold - epsilon, epsilon))
+    pairs = lsh_candidate_pairs(signatures, threshold, bands=bands, rows=rows)
+    estimates = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+    for (i1, i2), estimate in zip(pairs.tolist(), estimates.tolist()):
+        if estimate >= threshold:
+            chamber_overlap_dict[users[i1]][users[i2]] = estimate
+    return chamber_overlap_dict
@@ -0,0 +1,109 @@
+import numpy as np
+from collections.abc import Mapping
+from graph_arrays import node_positions
+
+
+class CommunityAssignment(Mapping):
+    """Community of every node encoded once as integer arrays aligned with the nodes of a graph.
+    It is a read-only mapping from node labels to communities, so it can be passed wherever
+    the community dictionary is expected, and the analyses use its arrays directly
+    Parameters
+    nodes: list with the node labels of the graph, as CSRGraph.nodes
+    node_index: dictionary with node labels as keys and their integer index as values, or range(n)
+    modules: dictionary with nodes as keys and communities as values, it may hold nodes
+    that are not in the graph
+
+    Attributes
+    communities: list with the community of each code, in order of first appearance in modules
+    codes: int32 array with the community code of each node of the graph, -1 for no community
+    sizes: array with the number of entries of modules in each community, as get_community_size
+    key_codes: int32 array with the community code of each entry of modules, in its order
+    key_positions: int32 array with the node index of each entry of modules, -1 if not in the graph
+    outside: dictionary with the entries of modules that are not nodes of the graph
+    """
+
+    def __init__(self, nodes, node_index, modules):
+        self.nodes = nodes
+        self.node_index = node_index
+        labels = list(modules)
+        community_index = {}
+        self.key_codes = np.fromiter((community_index.setdefault(community, len(community_index))
+                                      for community in modules.values()), dtype=np.int32, count=len(labels))
+        self.communities = list(community_index)
+        self.sizes = np.bincount(self.key_codes, minlength=len(self.communities))
+
+        self.key_positions = node_positions(node_index, labels).astype(np.int32)
+        in_graph = self.key_positions >= 0
+        self.codes = np.full(len(nodes), -1, dtype=np.int32)
+        self.codes[self.key_positions[in_graph]] = self.key_codes[in_graph]
+        self.outside = {labels[key]: self.communities[self.key_codes[key]] for key in np.flatnonzero(~in_graph)}
+        self._members = None
+
+    def __getitem__(self, node):
+        position = node_positions(self.node_index, [node])[0]
+        if position >= 0 and self.codes[position] >= 0:
+            return self.communities[self.codes[position]]
+        return self.outside[node]
+
+    def __iter__(self):
+        outside = iter(self.outside)
+        for position in self.key_positions.tolist():
+            yield self.nodes[position] if position >= 0 else next(outside)
+
+    def __len__(self):
+        return len(self.key_codes)
+
+    def values(self):
+        return [self.communities[code] for code in self.key_codes.tolist()]
+
+    def aligned(self, nodes):
+        """Function to check if the codes are aligned with a list of node labels"""
+        return nodes is self.nodes or (len(nodes) == len(self.nodes) and list(nodes) == list(self.nodes))
+
+    def members(self, code):
+        """Array with the index of the nodes of the graph in the community of a code, computed
+        for all the communities with a single sort the first time"""
+        if self._members is None:
+            order = np.argsort(self.codes, kind="stable")
+            boundaries = np.searchsorted(self.codes[order], np.arange(-1, len(self.communities)))
+            self._members = [order[start:end] for start, end in zip(boundaries[1:], np.append(boundaries[2:], len(order)))]
+        return self._members[code]
+
+    def size_dict(self):
+        """Dictionary with communities as keys and their size as values, as get_community_size"""
+        return dict(zip(self.communities, self.sizes.tolist()))
+
+    @property
+    def network_size(self):
+        """Sum of the communities of all the entries, the normalization of the community interaction"""
+        return sum(community*size for community, size in zip(self.communities, self.sizes.tolist()))
+
+
+def as_assignment(graph, modules):
+    """Function to get the community assignment of a graph, encoding it only if needed
+    Parameters
+    graph: CSRGraph or EdgeStore object
+    modules: dictionary with nodes as keys and communities as values, or CommunityAssignment
+
+    Returns
+    assignment: CommunityAssignment aligned with the nodes of the graph
+    """
+    if isinstance(modules, CommunityAssignment) and modules.aligned(graph.nodes):
+        return modules
+    return CommunityAssignment(graph.nodes, graph.node_index, modules)
+
+
+def get_community_size(community_info):
+    """Function to transform the dictionary of nodes and communities to a dictionary with communities and their size
+    Parameters
+    community_info: dictionary with nodes as keys and communities as values, or CommunityAssignment
+
+    Returns
+    community_counts: dictionary with communities as keys and size as values
+    """
+    if isinstance(community_info, CommunityAssignment):
+        return community_info.size_dict()
+    community_counts = {}
+    for community in community_info.values():
+        community_counts[community] = community_counts.get(community, 0) + 1
+    return community_counts
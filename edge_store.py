@@ -0,0 +1,349 @@
+import os
+import json
+import numpy as np
+from collections import namedtuple
+from collections.abc import Mapping
+
+# Increase when the layout of the stored edges changes
+EDGE_STORE_VERSION = 1
+# One record of 12 bytes per edge
+EDGE_DTYPE = np.dtype([("source", "<i4"), ("target", "<i4"), ("weight", "<f4")])
+DEFAULT_CHUNK_SIZE = 1 << 22
+
+# Edges of a graph memory-mapped from disk. edges is a read-only structured memmap with
+# the source, target and weight of each edge, nodes the memory-mapped string array of labels
+# (range(n) if the store has none) and node_index their position, a LabelIndex or range(n)
+EdgeStore = namedtuple("EdgeStore", ["path", "edges", "nodes", "node_index", "directed"])
+
+
+class LabelIndex(Mapping):
+    """Read-only mapping from the node labels of an edge store to their position, used as the
+    node_index of the store. The labels stay in their string array, and the index, an argsort
+    of the labels searched with searchsorted, is only built by the first lookup
+    Parameters
+    labels: array with the label of each node
+    """
+
+    def __init__(self, labels):
+        self.labels = labels
+        self._order = None
+        self._sorted = None
+
+    def positions(self, labels):
+        """Function to get the position of many labels at once
+        Parameters
+        labels: list of node labels
+
+        Returns
+        positions: array with the position of each label, -1 for the labels not in the store
+        """
+        labels = list(labels)
+        positions = np.full(len(labels), -1, dtype=np.int64)
+        keys = np.array([key for key, label in enumerate(labels) if isinstance(label, str)], dtype=np.int64)
+        if len(keys) == 0 or len(self.labels) == 0:
+            return positions
+        if self._order is None:
+            self._order = np.argsort(self.labels, kind="stable")
+            self._sorted = self.labels[self._order]
+        wanted = np.array([labels[key] for key in keys.tolist()], dtype=str)
+        found = np.minimum(np.searchsorted(self._sorted, wanted), len(self._sorted) - 1)
+        match = self._sorted[found] == wanted
+        positions[keys[match]] = self._order[found[match]]
+        return positions
+
+    def __getitem__(self, label):
+        position = self.positions([label])[0]
+        if position < 0:
+            raise KeyError(label)
+        return int(position)
+
+    def __iter__(self):
+        return iter(self.labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+
+def is_edge_store(path):
+    """Function to check if a path is an edge store directory"""
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, "meta.json"))
+
+
+def _write_edges(path, chunks):
+    # Append the chunks of edges to the binary file of the store, returns the number of edges
+    n_edges = 0
+    with open(os.path.join(path, "edges.bin"), 'wb') as f:
+        for sources, targets, weights in chunks:
+            records = np.empty(len(sources), dtype=EDGE_DTYPE)
+            records["source"] = sources
+            records["target"] = targets
+            records["weight"] = 1 if weights is None else weights
+            f.write(records.tobytes())
+            n_edges += len(records)
+    return n_edges
+
+
+def _write_meta(path, n_nodes, n_edges, nodes, directed):
+    # Write the node labels and then the metadata, replaced at once so that a store is valid only when complete
+    if n_nodes >= 2**31:
+        raise ValueError("Edge stores hold at most 2^31-1 nodes")
+    if nodes is not None:
+        np.save(os.path.join(path, "nodes.npy"), np.array([str(node) for node in nodes]), allow_pickle=False)
+    meta = {"version": EDGE_STORE_VERSION, "n_nodes": int(n_nodes), "n_edges": int(n_edges),
+            "directed": directed, "labels": nodes is not None}
+    meta_file = os.path.join(path, "meta.json")
+    with open(meta_file + ".tmp", 'w') as f:
+        json.dump(meta, f)
+    os.replace(meta_file + ".tmp", meta_file)
+
+
+def _start_store(path):
+    # Create the directory of a store and invalidate the previous store in it
+    os.makedirs(path, exist_ok=True)
+    meta_file = os.path.join(path, "meta.json")
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+
+
+def write_edge_store(path, chunks, n_nodes, nodes=None, directed=True):
+    """Function to write an edge store from chunks of edges, without holding all of them in memory
+    Parameters
+    path: directory of the store
+    chunks: iterable of (sources, targets, weights) arrays, weights may be None for weight 1
+    n_nodes: number of nodes, sources and targets are integers from 0 to n_nodes-1
+    nodes: optional list of node labels, one per node
+    directed: False if each undirected edge is stored once
+
+    Returns
+    store: the EdgeStore opened from the written files
+    """
+    if n_nodes >= 2**31:
+        raise ValueError("Edge stores hold at most 2^31-1 nodes")
+    _start_store(path)
+    n_edges = _write_edges(path, chunks)
+    _write_meta(path, n_nodes, n_edges, nodes, directed)
+    return open_edge_store(path)
+
+
+def open_edge_store(path):
+    """Function to memory-map an edge store
+    Parameters
+    path: directory of the store
+
+    Returns
+    store: EdgeStore object, the edges and the node labels are memory-mapped
+    """
+    with open(os.path.join(path, "meta.json"), 'r') as f:
+        meta = json.load(f)
+    if meta.get("version") != EDGE_STORE_VERSION:
+        raise ValueError(f"Unsupported edge store version {meta.get('version')} in {path}")
+    if meta["n_edges"] > 0:
+        edges = np.memmap(os.path.join(path, "edges.bin"), dtype=EDGE_DTYPE, mode='r', shape=(meta["n_edges"],))
+    else:
+        edges = np.empty(0, dtype=EDGE_DTYPE)
+    if meta["labels"]:
+        nodes = np.load(os.path.join(path, "nodes.npy"), mmap_mode='r', allow_pickle=False)
+        node_index = LabelIndex(nodes)
+    else:
+        nodes = node_index = range(meta["n_nodes"])
+    return EdgeStore(path, edges, nodes, node_index, meta["directed"])
+
+
+def edge_store_from_csr(graph, path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Function to write the edges of a CSR graph to an edge store, each undirected edge once
+    Parameters
+    graph: CSRGraph object
+    path: directory of the store
+    chunk_size: number of edges written at once
+
+    Returns
+    store: EdgeStore object
+    """
+    from graph_arrays import edge_arrays
+
+    sources, targets, weights = edge_arrays(graph)
+    chunks = ((sources[start:start + chunk_size], targets[start:start + chunk_size], weights[start:start + chunk_size])
+              for start in range(0, len(sources), chunk_size))
+    nodes = None if isinstance(graph.nodes, range) else graph.nodes
+    return write_edge_store(path, chunks, len(graph.nodes), nodes=nodes, directed=graph.directed)
+
+
+def edge_store_from_text(edge_file, path, directed=True, delimiter=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Function to convert a text edge list, one 'source target [weight]' edge per line,
+    to an edge store reading it by chunks. Only the node labels are kept in memory
+    Parameters
+    edge_file: path of the text file
+    path: directory of the store
+    directed: False if each undirected edge appears once in the file
+    delimiter: separator of the fields, any whitespace by default
+    chunk_size: number of edges converted at once
+
+    Returns
+    store: EdgeStore object
+    """
+    node_index = {}
+
+    def chunks():
+        sources, targets, weights = [], [], []
+        with open(edge_file, 'r') as f:
+            for line in f:
+                fields = line.split(delimiter)
+                if len(fields) < 2 or fields[0].startswith("#"):
+                    continue
+                sources.append(node_index.setdefault(fields[0].strip(), len(node_index)))
+                targets.append(node_index.setdefault(fields[1].strip(), len(node_index)))
+                weights.append(float(fields[2]) if len(fields) > 2 else 1.0)
+                if len(sources) == chunk_size:
+                    yield np.array(sources), np.array(targets), np.array(weights)
+                    sources, targets, weights = [], [], []
+        if sources:
+            yield np.array(sources), np.array(targets), np.array(weights)
+
+    # The labels are only complete once all the chunks are written, so they are stored after
+    _start_store(path)
+    n_edges = _write_edges(path, chunks())
+    _write_meta(path, len(node_index), n_edges, list(node_index), directed)
+    return open_edge_store(path)
+
+
+def iter_edge_chunks(store, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Generator over the edges of a store by chunks, only one chunk is read at a time
+    Parameters
+    store: EdgeStore object
+    chunk_size: number of edges per chunk
+
+    Yields
+    sources, targets, weights: arrays with the edges of the chunk
+    """
+    # Reading the file by chunks instead of through the mapping keeps the pages of the
+    # finished chunks out of the resident memory of the process
+    remaining = len(store.edges)
+    with open(os.path.join(store.path, "edges.bin"), 'rb') as f:
+        while remaining > 0:
+            chunk = np.fromfile(f, dtype=EDGE_DTYPE, count=min(chunk_size, remaining))
+            if len(chunk) == 0:
+                raise ValueError(f"Truncated edge store in {store.path}")
+            remaining -= len(chunk)
+            yield chunk["source"], chunk["target"], chunk["weight"]
+
+
+def store_block_contingency(store, blocks, n_blocks=2, block_sizes=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Function to calculate the block contingency of polarization.block_contingency by chunks
+    Parameters
+    store: EdgeStore object
+    blocks: integer array with the block of each node
+    n_blocks: number of blocks
+    block_sizes: optional array with the number of nodes of each block, counted from blocks by default
+    chunk_size: number of edges per chunk
+
+    Returns
+    contingency: dictionary with edge_counts, edge_weights, block_sizes and directed
+    """
+    blocks = np.asarray(blocks)
+    edge_counts = np.zeros(n_blocks*n_blocks, dtype=np.int64)
+    edge_weights = np.zeros(n_blocks*n_blocks, dtype=np.float64)
+    for sources, targets, weights in iter_edge_chunks(store, chunk_size):
+        pair_index = n_blocks*blocks[sources] + blocks[targets]
+        edge_counts += np.bincount(pair_index, minlength=n_blocks*n_blocks)
+        edge_weights += np.bincount(pair_index, weights=weights, minlength=n_blocks*n_blocks)
+    if block_sizes is None:
+        block_sizes = np.bincount(blocks[blocks >= 0], minlength=n_blocks)
+    return {"edge_counts": edge_counts.reshape(n_blocks, n_blocks)
+            , "edge_weights": edge_weights.reshape(n_blocks, n_blocks)
+            , "block_sizes": block_sizes
+            , "directed": store.directed}
+
+
+def store_flow_matrix(store, codes, communities, loop_links=True, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Function to calculate the flows between communities of entropy.get_community_flow_matrix by chunks
+    Parameters
+    store: EdgeStore object
+    codes: integer array with the community code of each node, -1 for no community
+    communities: list with the community of each code
+    loop_links: boolean to set if loops are considered
+    chunk_size: number of edges per chunk
+
+    Returns
+    communities: list of the communities linked by at least one edge, in order of first appearance
+    flow_matrix: sparse matrix with the total weight from each community (row) to each community (column)
+    """
+    from scipy import sparse
+
+    n_codes = len(communities)
+    # Sparse flows between codes, each chunk summed into it so that only the linked pairs are stored
+    flows = sparse.csr_matrix((n_codes, n_codes), dtype=np.float64)
+    # Position of the first edge end of each community, as in the interleaved endpoints of the whole graph
+    first_seen = np.full(n_codes, np.iinfo(np.int64).max, dtype=np.int64)
+    offset = 0
+    for sources, targets, weights in iter_edge_chunks(store, chunk_size):
+        source_codes = codes[sources]
+        target_codes = codes[targets]
+        keep = (source_codes >= 0) & (target_codes >= 0)
+        if not loop_links:
+            keep &= source_codes != target_codes
+        kept = np.flatnonzero(keep)
+        source_codes = source_codes[kept]
+        target_codes = target_codes[kept]
+        chunk_flows = sparse.coo_matrix((weights[kept].astype(np.float64), (source_codes, target_codes)),
+                                        shape=(n_codes, n_codes)).tocsr()
+        chunk_flows.sum_duplicates()
+        flows = flows + chunk_flows
+
+        positions = np.concatenate([2*(offset + kept), 2*(offset + kept) + 1])
+        endpoints = np.concatenate([source_codes, target_codes])
+        np.minimum.at(first_seen, endpoints, positions)
+        offset += len(sources)
+
+    present = np.flatnonzero(first_seen < np.iinfo(np.int64).max)
+    present = present[np.argsort(first_seen[present], kind="stable")]
+    position = np.full(n_codes, -1, dtype=np.int64)
+    position[present] = np.arange(len(present))
+    flows = flows.tocoo()
+    flow_matrix = sparse.coo_matrix((flows.data, (position[flows.row], position[flows.col])),
+                                    shape=(len(present), len(present))).tocsr()
+    flow_matrix.sum_duplicates()
+    return [communities[code] for code in present], flow_matrix
+
+
+def store_node_flows(store, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Function to calculate the degrees and strengths of graph_arrays.node_flows by chunks
+    Parameters
+    store: EdgeStore object
+    chunk_size: number of edges per chunk
+
+    Returns
+    flows: dictionary with nodes, node_index, in_degree, out_degree, in_strength and out_strength
+    """
+    n_nodes = len(store.nodes)
+    flows = {"in_degree": np.zeros(n_nodes, dtype=np.int64), "out_degree": np.zeros(n_nodes, dtype=np.int64),
+             "in_strength": np.zeros(n_nodes), "out_strength": np.zeros(n_nodes)}
+    for sources, targets, weights in iter_edge_chunks(store, chunk_size):
+        flows["in_degree"] += np.bincount(targets, minlength=n_nodes)
+        flows["out_degree"] += np.bincount(sources, minlength=n_nodes)
+        flows["in_strength"] += np.bincount(targets, weights=weights, minlength=n_nodes)
+        flows["out_strength"] += np.bincount(sources, weights=weights, minlength=n_nodes)
+    return dict(flows, nodes=store.nodes, node_index=store.node_index)
+
+
+def main(input_file, output_path, directed=True, delimiter=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    if input_file.endswith(".gml"):
+        from graph_cache import load_graph
+        store = edge_store_from_csr(load_graph(input_file), output_path, chunk_size=chunk_size)
+    else:
+        store = edge_store_from_text(input_file, output_path, directed=directed, delimiter=delimiter,
+                                     chunk_size=chunk_size)
+    print(f"{len(store.edges)} edges between {len(store.nodes)} nodes written to {output_path}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert a network to a memory-mapped binary edge store")
+    parser.add_argument("input_file", help="gml file or text file with one 'source target [weight]' edge per line")
+    parser.add_argument("output_path", help="directory of the edge store")
+    parser.add_argument("--undirected", action="store_true", help="take the edges of a text file as undirected")
+    parser.add_argument("--delimiter", default=None, help="field separator of a text file, any whitespace by default")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="number of edges converted at once")
+    args = parser.parse_args()
+    main(args.input_file, args.output_path, directed=not args.undirected, delimiter=args.delimiter,
+         chunk_size=args.chunk_size)
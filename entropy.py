@@ -1,11 +1,15 @@
 import os
-import subprocess
-import glob
 import sys
 import json
-import networkx as nx
-from scipy.stats import entropy
-import math
+import multiprocessing
+import numpy as np
+from scipy import sparse
+from graph_cache import load_graph
+from edge_store import EdgeStore, store_flow_matrix
+from instrumentation import NULL_RECORDER, Recorder, print_progress
+from online_stats import replicate_seeds
+from graph_arrays import as_csr, edge_arrays
+from communities import CommunityAssignment, as_assignment, get_community_size
 
 def add_or_update_edge(graph, source, target, weight):
     if graph.has_edge(source, target):
@@ -17,118 +21,329 @@ def add_or_update_edge(graph, source, target, weight):
         # Edge doesn't exist, add it with the given weight
         graph.add_edge(source, target, weight=weight)
 
-def get_community_size(community_info):
-    """
-    Function to transform the dictionary of nodes and communities to a dictionary with communities and their size
+def get_community_flow_matrix(G,community_info,loop_links=True):
+    """This function aggregates the flows between the nodes of a network into the flows
+    between their communities with a single sparse aggregation over the edges
     Parameters
-    community_info: dictionary with nodes as keys and communities as values
+    G: network between nodes, networkx graph object, CSRGraph or EdgeStore, read by chunks
+    community_info: dictionary with nodes as keys and communities as values, or CommunityAssignment
+    loop_links:boolean to set if loops are considered
 
     Returns
-    community_counts: dictionary with communities as keys as size as values
-
+    communities: list of the communities linked by at least one edge, in order of first appearance
+    flow_matrix: sparse matrix with the total weight from each community (row) to each community (column)
     """
-    community_counts = {}
-    for community in community_info.values():
-        if community_counts.get(community,"error")!="error":
-            community_counts[community] += 1
-        else:
-            community_counts[community] = 1
+    graph=G if isinstance(G,EdgeStore) else as_csr(G)
+    assignment=as_assignment(graph,community_info)
+    codes,communities=assignment.codes,assignment.communities
+    if isinstance(graph,EdgeStore):
+        return store_flow_matrix(graph,codes,communities,loop_links=loop_links)
+    sources,targets,weights=edge_arrays(graph)
+
+    # Keep the edges between nodes with a community
+    source_codes=codes[sources]
+    target_codes=codes[targets]
+    keep=(source_codes>=0)&(target_codes>=0)
+    if loop_links==False:
+        keep&=source_codes!=target_codes
+    source_codes=source_codes[keep]
+    target_codes=target_codes[keep]
+
+    # Communities in the order in which the edges reach them
+    endpoints=np.empty(2*len(source_codes),dtype=np.int64)
+    endpoints[0::2]=source_codes
+    endpoints[1::2]=target_codes
+    present,first=np.unique(endpoints,return_index=True)
+    present=present[np.argsort(first,kind="stable")]
+    position=np.full(len(communities),-1,dtype=np.int64)
+    position[present]=np.arange(len(present))
+
+    flow_matrix=sparse.coo_matrix((weights[keep].astype(np.float64),(position[source_codes],position[target_codes])),
+                                  shape=(len(present),len(present))).tocsr()
+    flow_matrix.sum_duplicates()
+    return [communities[code] for code in present],flow_matrix
+
+def as_flow_matrix(community_graph):
+    """Function to get the communities and the sparse flow matrix of a network between communities
+    Parameters
+    community_graph: networkx DiGraph between communities, or tuple (communities, flow_matrix)
+    as returned by get_community_flow_matrix
 
-    return community_counts
+    Returns
+    communities: list of communities
+    flow_matrix: sparse matrix with the weight from each community (row) to each community (column)
+    """
+    if isinstance(community_graph,tuple):
+        return community_graph
+    import networkx as nx
+    communities=list(community_graph.nodes())
+    flow_matrix=nx.to_scipy_sparse_array(community_graph,nodelist=communities,weight="weight",format="csr")
+    return communities,sparse.csr_matrix(flow_matrix,dtype=np.float64)
 
 def get_community_network(G,community_info,loop_links=True):
     """This function reads the a network and returns the network between the communities given a community partition
     Parameters
-    G: network between nodes
-    community_info: dictionary with nodes as keys and communities as values
-    community_counts: dictionary with communities as keys as size as values
+    G: network between nodes, networkx graph object, CSRGraph or EdgeStore
+    community_info: dictionary with nodes as keys and communities as values, or CommunityAssignment
     loop_links:boolean to set if loops are considered
 
     Returns
     G_community: network between communities
     """
-    G_community=nx.DiGraph()
-    community_counts=get_community_size(community_info)
-
-    weights=[]
-    if loop_links==False:
-        for edge in G.edges(data=True):
-            if community_info.get(edge[0],"error")!="error" and community_info.get(edge[1],"error")!="error":
-
-                if community_counts.get(community_info[edge[0]],"error")!="error" and community_counts.get(community_info[edge[1]],"error")!="error":
-                    if community_info[edge[0]]!=community_info[edge[1]]:
-                        add_or_update_edge(G_community, community_info[edge[0]],community_info[edge[1]],weight=edge[2]["weight"])
-    else:
-        for edge in G.edges(data=True):
-            if community_info.get(edge[0],"error")!="error" and community_info.get(edge[1],"error")!="error":
-
-                if community_counts.get(community_info[edge[0]],"error")!="error" and community_counts.get(community_info[edge[1]],"error")!="error":
+    import networkx as nx
 
-                        add_or_update_edge(G_community, community_info[edge[0]],community_info[edge[1]],weight=edge[2]["weight"])
+    communities,flow_matrix=get_community_flow_matrix(G,community_info,loop_links=loop_links)
+    G_community=nx.DiGraph()
+    G_community.add_nodes_from(communities)
+    flows=flow_matrix.tocoo()
+    G_community.add_weighted_edges_from(zip([communities[row] for row in flows.row],
+                                            [communities[column] for column in flows.col],
+                                            flows.data.tolist()))
     return G_community
 
 def get_community_polarization(community_graph):
     """
     Function to calculate the polarization of the communities given by the ratio
     of loop links divided by the total amount of links
+    Parameters
+    community_graph: networkx DiGraph between communities, or tuple (communities, flow_matrix)
     """
+    communities,flow_matrix=as_flow_matrix(community_graph)
+    total=np.asarray(flow_matrix.sum(axis=1)).ravel()
+    il=flow_matrix.diagonal()
+    el=total-il
     polarization_dict={}
-    for community in community_graph.nodes():
-        total=0
-        il=0
-        el=0
-        for target in community_graph[community]:
-            total+=community_graph[community][target]["weight"]
-            if community==target:
-                il+=community_graph[community][target]["weight"]
-            else:
-                el+=community_graph[community][target]["weight"]
-        if total>0:
-            polarization_dict[community]=(el-il)/(total)
+    for community in np.flatnonzero(total>0):
+        polarization_dict[communities[community]]=float((el[community]-il[community])/total[community])
     return polarization_dict
 
-def get_community_interaction(community_graph,community_dict):
+def get_community_interaction(community_graph,community_dict,flows=None):
     """
-    Function to calculate the polarization of the communities given by the ratio
-    of loop links divided by the total amount of links
+    Function to calculate the interaction of the communities as their outflow
+    weighted by their size
+    Parameters
+    community_graph: networkx DiGraph between communities, or tuple (communities, flow_matrix),
+    not used if flows is given
+    community_dict: dictionary with nodes as keys and communities as values, or CommunityAssignment
+    flows: optional dictionary of arrays from graph_arrays.node_flows. The outflow of each
+    community is then the out strength of its members, which also counts the edges
+    towards nodes without community
+
+    Returns
+    interaction: dictionary with communities as keys and interaction as values
     """
     community_size=get_community_size(community_dict)
-    network_size=sum(community_dict.values())
-    outflow={}
-    interaction={}
-    for community in community_graph.nodes():
-        outflow[community]=0
-        for community1 in community_graph[community]:
-            outflow[community]+=community_graph[community][community1]["weight"]
+    if isinstance(community_dict,CommunityAssignment):
+        network_size=community_dict.network_size
+    else:
+        network_size=sum(community_dict.values())
+    if flows is not None:
+        if isinstance(community_dict,CommunityAssignment) and community_dict.aligned(flows["nodes"]):
+            assignment=community_dict
+        else:
+            assignment=CommunityAssignment(flows["nodes"],flows["node_index"],community_dict)
+        codes=assignment.codes
+        with_community=codes>=0
+        outflow=np.bincount(codes[with_community],weights=flows["out_strength"][with_community],
+                            minlength=len(assignment.communities))
+        # Only the communities of the nodes of the graph
+        in_graph=np.flatnonzero(np.bincount(codes[with_community],minlength=len(assignment.communities))>0)
+        communities=[assignment.communities[code] for code in in_graph]
+        outflow=outflow[in_graph]
+    else:
+        communities,flow_matrix=as_flow_matrix(community_graph)
+        outflow=np.asarray(flow_matrix.sum(axis=1)).ravel()
 
-        interaction[community]=(outflow[community]*community_size[community])/(network_size)
-    return interaction
+    size=np.array([community_size[community] for community in communities],dtype=np.float64)
+    return dict(zip(communities,(outflow*size/network_size).tolist()))
 
 def get_community_entropy(community_graph):
     """
     Function to calculate the entropy of the communities as
-    the diversity of communities
+    the diversity of communities, normalized by the entropy of
+    uniform flows to all the communities
+    Parameters
+    community_graph: networkx DiGraph between communities, or tuple (communities, flow_matrix)
     """
+    communities,flow_matrix=as_flow_matrix(community_graph)
+    flow_matrix=sparse.csr_matrix(flow_matrix)
+    flow_matrix.eliminate_zeros()
+    normalization=np.asarray(flow_matrix.sum(axis=1)).ravel()
+
+    # Shannon entropy of every row at once, missing flows contribute nothing
+    rows=np.repeat(np.arange(len(communities)),np.diff(flow_matrix.indptr))
+    probability=flow_matrix.data/normalization[rows]
+    row_entropy=np.bincount(rows,weights=-probability*np.log(probability),minlength=len(communities))
+
     entropy_dict={}
-    for community in community_graph.nodes():
-
-        entropy_array=[]
-        normalization=0
-        for community1 in community_graph[community]:
-            normalization+=community_graph[community][community1]["weight"]
-        if normalization!=0:
-            for community1 in community_graph.nodes():
-
-                if community_graph[community].get(community1,"error")!="error":
-
-                    entropy_array.append(community_graph[community][community1]["weight"]/normalization)
-                else:
-                    entropy_array.append(0)
-            if len(entropy_array)>0:
-                entropy_dict[community]=entropy(entropy_array)/math.log(len(entropy_array))
+    with np.errstate(divide="ignore",invalid="ignore"):
+        normalized_entropy=row_entropy/np.log(len(communities))
+    for community in np.flatnonzero(normalization!=0):
+        entropy_dict[communities[community]]=float(normalized_entropy[community])
     return entropy_dict
 
 
+def community_metric_arrays(source_codes,target_codes,weights,size,network_size):
+    """Function to calculate the polarization, entropy and interaction of all the communities
+    from the community codes of the ends of every edge, with the definitions of
+    get_community_polarization, get_community_entropy and get_community_interaction
+    Parameters
+    source_codes, target_codes: arrays with the community code of the ends of each edge, -1 for no community
+    weights: array with the weight of each edge
+    size: array with the size of each community code
+    network_size: normalization of the interaction
+
+    Returns
+    polarization, entropy, interaction: arrays with the metric of each community code, nan if
+    the community has no flows
+    """
+    n_codes=len(size)
+    keep=(source_codes>=0)&(target_codes>=0)
+    source_codes=source_codes[keep]
+    target_codes=target_codes[keep]
+    flow_matrix=sparse.coo_matrix((weights[keep].astype(np.float64),(source_codes,target_codes)),
+                                  shape=(n_codes,n_codes)).tocsr()
+    flow_matrix.sum_duplicates()
+    flow_matrix.eliminate_zeros()
+
+    # Communities of the network between communities
+    present=np.zeros(n_codes,dtype=bool)
+    present[source_codes]=True
+    present[target_codes]=True
+
+    total=np.asarray(flow_matrix.sum(axis=1)).ravel()
+    il=flow_matrix.diagonal()
+    rows=np.repeat(np.arange(n_codes),np.diff(flow_matrix.indptr))
+    probability=flow_matrix.data/total[rows]
+    row_entropy=np.bincount(rows,weights=-probability*np.log(probability),minlength=n_codes)
+
+    with np.errstate(divide="ignore",invalid="ignore"):
+        polarization=np.where(total>0,(total-2*il)/total,np.nan)
+        entropy=np.where(total!=0,row_entropy/np.log(present.sum()),np.nan)
+    interaction=np.where(present,total*size/network_size,np.nan)
+    return polarization,entropy,interaction
+
+# Edge and community arrays shared by the null-model workers, set once per process
+_null_model_state={}
+
+def _init_null_model_worker(state):
+    _null_model_state.update(state)
+
+def community_null_model_replicate(seed):
+    """Function to calculate the community metrics of one randomized replicate
+    Parameters
+    seed: integer seed of the replicate
+
+    Returns
+    metrics: array of shape (3, number of communities) with polarization, entropy and interaction
+    """
+    state=_null_model_state
+    rng=np.random.default_rng(seed)
+    codes=state["codes"]
+    sources=state["sources"]
+    targets=state["targets"]
+    if state["mode"]=="rewire":
+        # Shuffling the targets keeps the in and out degree of every node and the weight of every edge
+        targets=targets[rng.permutation(len(targets))]
+    else:
+        # Shuffle the communities among the nodes that have one
+        with_community=np.flatnonzero(codes>=0)
+        codes=codes.copy()
+        codes[with_community]=codes[with_community[rng.permutation(len(with_community))]]
+    return np.stack(community_metric_arrays(codes[sources],codes[targets],state["weights"],
+                                            state["size"],state["network_size"]))
+
+def community_null_model(G,modules,mode="rewire",n_replicates=100,n_workers=1,seed=None):
+    """Function to assess the community polarization, entropy and interaction against
+    randomized versions of the network
+    Parameters
+    G: network between nodes, networkx graph object or CSRGraph
+    modules: dictionary with nodes as keys and communities as values, or CommunityAssignment
+    mode: randomization, "rewire" shuffles the targets of the edges keeping the in and out
+    degree of every node, "labels" shuffles the communities among the nodes
+    n_replicates: number of randomized networks
+    n_workers: number of worker processes, 1 runs the replicates in this process
+    seed: base seed of the ensemble, each replicate gets its own seed derived from it
+
+    Returns
+    null_model: dictionary with the metrics as keys and, for each one, a dictionary with the
+    communities as keys and the observed value, mean, standard deviation and z-score as values
+    """
+    if mode not in ("rewire","labels"):
+        raise ValueError(f"Unknown randomization {mode}, use rewire or labels")
+    graph=as_csr(G)
+    assignment=as_assignment(graph,modules)
+    codes,communities=assignment.codes,assignment.communities
+    sources,targets,weights=edge_arrays(graph)
+    state={"mode":mode,"codes":codes,"sources":sources,"targets":targets,"weights":weights,
+           "size":assignment.sizes.astype(np.float64),"network_size":assignment.network_size}
+
+    observed=np.stack(community_metric_arrays(codes[sources],codes[targets],weights,state["size"],state["network_size"]))
+
+    seeds=replicate_seeds(n_replicates,seed)
+    if n_workers is None:
+        n_workers=os.cpu_count()
+    if n_workers<=1:
+        _init_null_model_worker(state)
+        randomized=[community_null_model_replicate(replicate_seed) for replicate_seed in seeds]
+    else:
+        with multiprocessing.Pool(n_workers,initializer=_init_null_model_worker,initargs=(state,)) as pool:
+            randomized=pool.map(community_null_model_replicate,seeds,chunksize=max(1,n_replicates//(4*n_workers)))
+    randomized=np.stack(randomized)
+
+    with np.errstate(divide="ignore",invalid="ignore"):
+        mean=np.nanmean(randomized,axis=0)
+        std=np.nanstd(randomized,axis=0,ddof=1)
+        z_score=(observed-mean)/std
+
+    null_model={}
+    for row,metric in enumerate(("polarization","entropy","interaction")):
+        null_model[metric]={}
+        for code in np.flatnonzero(~np.isnan(observed[row])):
+            null_model[metric][communities[code]]={"observed":float(observed[row,code])
+                                                   ,"mean":float(mean[row,code])
+                                                   ,"std":float(std[row,code])
+                                                   ,"z_score":float(z_score[row,code])}
+    return null_model
+
+def run_entropy(G,modules,null_model=None,recorder=NULL_RECORDER):
+    """Function to calculate the polarization, entropy and interaction of the communities
+    Parameters
+    G: network between nodes, networkx graph object, CSRGraph or EdgeStore
+    modules: dictionary with nodes as keys and communities as values, or CommunityAssignment
+    null_model: optional dictionary with the parameters of community_null_model, if given
+    the metrics are also compared with randomized networks
+    recorder: optional instrumentation.Recorder of the community flows, metrics and null model stages
+
+    Returns
+    results: dictionary with the polarization, entropy and interaction dictionaries
+    """
+    # Encode the graph and the communities once for all the metrics
+    if not isinstance(G,EdgeStore):
+        G=as_csr(G)
+    modules=as_assignment(G,modules)
+
+    # Calculate the flows between communities
+    with recorder.stage("community_flows") as stage:
+        G_com = get_community_flow_matrix(G,modules)
+        stage["items"] = len(G_com[0])
+
+    # Get regular polarization, entropy and interaction
+    with recorder.stage("community_metrics") as stage:
+        community_polarization = get_community_polarization(G_com)
+        community_entropy = get_community_entropy(G_com)
+        community_interaction = get_community_interaction(G_com,modules)
+        stage["items"] = len(G_com[0])
+
+    results={"polarization":community_polarization
+             ,"entropy":community_entropy
+             ,"interaction":community_interaction}
+    if null_model is not None:
+        with recorder.stage("community_null_model") as stage:
+            results["null_model"]=community_null_model(G,modules,**null_model)
+            stage["items"]=null_model.get("n_replicates",100)
+    return results
+
 def main(infile):
     # Read configuration file
     config_file = f"{infile}"
@@ -140,23 +355,25 @@ def main(infile):
     FILE_PATH = config["path"]
     network_file = config["network_file"]
     community_file = config["community_file"]
-    ## Define the main opposed communities
-    relevant_communities = [0, 1]
-    G = nx.read_gml(f"{FILE_PATH}{network_file}")
+    # Optional log of the time and memory of every stage, as in run_analyses
+    recorder=NULL_RECORDER
+    if config.get("log_file") is not None or config.get("progress"):
+        recorder=Recorder(log_file=config.get("log_file"),progress=print_progress if config.get("progress") else None)
+
+    # Binary graph cache shared with the other scripts
+    with recorder.stage("load") as stage:
+        G = load_graph(f"{FILE_PATH}{network_file}",cache_dir=config.get("cache_dir"))
+        stage["items"] = len(G.nodes)
 
     # Open the JSON file
     with open(f"{FILE_PATH}{community_file}", 'r') as f:
         # Read the JSON data
         modules = json.load(f)
 
-
-    # Calculate community network
-    G_com = get_community_network(G,modules)
-
-    # Get regular polarization, entropy and interaction
-    community_polarization = get_community_polarization(G_com)
-    community_entropy = get_community_entropy(G_com)
-    community_interaction = get_community_interaction(G_com,modules)
+    try:
+        return run_entropy(G,modules,null_model=config.get("null_model"),recorder=recorder)
+    finally:
+        recorder.close()
 
 if __name__ == '__main__':
     main(sys.argv[1])
@@ -0,0 +1,267 @@
+import numpy as np
+from collections import namedtuple
+from edge_store import EdgeStore, LabelIndex
+
+# Compact array representation of a graph.
+# nodes: list with the node labels, the position of a label is its integer index
+# node_index: dictionary with node labels as keys and the integer index as value
+# indptr, indices: CSR arrays, the neighbours of node i are indices[indptr[i]:indptr[i+1]]
+# weights: float32 weight of each entry of indices
+# directed: if True each edge is stored once in the row of its source, otherwise
+# each edge is stored in the rows of both ends (self-loops only once)
+CSRGraph = namedtuple("CSRGraph", ["nodes", "node_index", "indptr", "indices", "weights", "directed"])
+
+
+def index_dtype(n_nodes):
+    """Smallest integer type able to index n_nodes nodes"""
+    return np.int32 if n_nodes < np.iinfo(np.int32).max else np.int64
+
+
+def csr_from_edges(sources, targets, weights, nodes, directed=True):
+    """Function to build the CSR graph from arrays of edges
+    Parameters
+    sources: array with the integer index of the source of each edge
+    targets: array with the integer index of the target of each edge
+    weights: array with the weight of each edge, None sets all weights to 1
+    nodes: list of node labels, the integer index of a node is its position,
+    range(n) labels the nodes by their index
+    directed: if False every edge is also stored in the row of its target
+
+    Returns
+    graph: CSRGraph object
+    """
+    n_nodes = len(nodes)
+    dtype = index_dtype(n_nodes)
+    sources = np.asarray(sources, dtype=dtype)
+    targets = np.asarray(targets, dtype=dtype)
+    if weights is None:
+        weights = np.ones(len(sources), dtype=np.float32)
+    else:
+        weights = np.asarray(weights, dtype=np.float32)
+
+    if not directed:
+        # Store both directions except for self-loops
+        reverse = sources != targets
+        sources, targets = np.concatenate([sources, targets[reverse]]), np.concatenate([targets, sources[reverse]])
+        weights = np.concatenate([weights, weights[reverse]])
+
+    # Edges are usually already grouped by source, avoid the sort in that case
+    if len(sources) > 1 and np.any(sources[1:] < sources[:-1]):
+        order = np.argsort(sources, kind="stable")
+        sources = sources[order]
+        targets = targets[order]
+        weights = weights[order]
+
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n_nodes), out=indptr[1:])
+
+    if isinstance(nodes, np.ndarray):
+        nodes = nodes.tolist()
+    if isinstance(nodes, range) and nodes.start == 0 and nodes.step == 1:
+        # Integer labels are their own index, avoid building the dictionary
+        node_index = nodes
+    else:
+        node_index = {node: i for i, node in enumerate(nodes)}
+    return CSRGraph(nodes, node_index, indptr, targets, weights, directed)
+
+
+def csr_from_networkx(G, weight="weight"):
+    """Function to convert a networkx graph into a CSR graph.
+    The networkx edges are traversed only once
+    Parameters
+    G: networkx graph object
+    weight: edge attribute with the weight, edges without it get weight 1
+
+    Returns
+    graph: CSRGraph object
+    """
+    nodes = list(G.nodes())
+    node_index = {node: i for i, node in enumerate(nodes)}
+    dtype = index_dtype(len(nodes))
+    edge_dtype = [("source", dtype), ("target", dtype), ("weight", np.float32)]
+    edges = np.fromiter(((node_index[u], node_index[v], w) for u, v, w in G.edges(data=weight, default=1)),
+                        dtype=edge_dtype, count=G.number_of_edges())
+    return csr_from_edges(edges["source"], edges["target"], edges["weight"], nodes, directed=G.is_directed())
+
+
+def as_csr(graph, weight="weight"):
+    """Function to get the CSR representation of a graph, converting it only if needed
+    Parameters
+    graph: CSRGraph, EdgeStore or networkx graph object, the edges of an EdgeStore are read into memory
+
+    Returns
+    graph: CSRGraph object
+    """
+    if isinstance(graph, CSRGraph):
+        return graph
+    if isinstance(graph, EdgeStore):
+        edges = np.asarray(graph.edges)
+        return csr_from_edges(edges["source"], edges["target"], edges["weight"], graph.nodes, directed=graph.directed)
+    return csr_from_networkx(graph, weight=weight)
+
+
+def edge_sources(graph):
+    """Array with the source of every entry of graph.indices"""
+    return np.repeat(np.arange(len(graph.nodes), dtype=graph.indices.dtype), np.diff(graph.indptr))
+
+
+def edge_arrays(graph):
+    """Function to get the edges of the graph as arrays, each edge appearing once
+    Parameters
+    graph: CSRGraph object
+
+    Returns
+    sources: array with the integer index of the source of each edge
+    targets: array with the integer index of the target of each edge
+    weights: array with the weight of each edge
+    """
+    sources = edge_sources(graph)
+    if graph.directed:
+        return sources, graph.indices, graph.weights
+    # Undirected edges are stored in both rows, keep one of the two copies
+    keep = sources <= graph.indices
+    return sources[keep], graph.indices[keep], graph.weights[keep]
+
+
+def node_values(graph, mapping, default=-1, dtype=np.int64):
+    """Function to align the values of a dictionary keyed by node labels with the node indices
+    Parameters
+    graph: CSRGraph object
+    mapping: dictionary with node labels as keys
+    default: value for the nodes missing in the dictionary
+
+    Returns
+    values: array with the value of each node
+    """
+    return np.fromiter((mapping.get(node, default) for node in graph.nodes), dtype=dtype, count=len(graph.nodes))
+
+
+def node_positions(node_index, labels):
+    """Function to get the integer index of some node labels
+    Parameters
+    node_index: node_index of a CSRGraph or EdgeStore, a dictionary, a LabelIndex or range(n)
+    labels: list of node labels
+
+    Returns
+    positions: array with the index of each label, -1 for the labels not in the graph
+    """
+    if isinstance(node_index, LabelIndex):
+        return node_index.positions(labels)
+    if isinstance(node_index, range):
+        return np.fromiter((label if label in node_index else -1 for label in labels), dtype=np.int64, count=len(labels))
+    return np.fromiter((node_index.get(label, -1) for label in labels), dtype=np.int64, count=len(labels))
+
+
+def nodes_dict(graph, values):
+    """Function to get a dictionary with node labels as keys from an array aligned with the nodes"""
+    return dict(zip(graph.nodes, values.tolist()))
+
+
+def largest_component(sources, targets, n_nodes):
+    """Function to keep the largest connected component of a graph given as edge arrays,
+    the direction of the edges is ignored
+    Parameters
+    sources: array with the integer index of the source of each edge
+    targets: array with the integer index of the target of each edge
+    n_nodes: number of nodes of the graph
+
+    Returns
+    sources: sources of the edges of the component, relabelled from 0
+    targets: targets of the edges of the component, relabelled from 0
+    component_nodes: array with the original index of each node of the component
+    """
+    sources, targets, _, component_nodes = largest_component_edges(sources, targets, None, n_nodes)
+    return sources, targets, component_nodes
+
+
+def largest_component_edges(sources, targets, weights, n_nodes):
+    """Function to keep the largest connected component of a weighted graph given as edge
+    arrays, the direction of the edges is ignored
+    Parameters
+    sources: array with the integer index of the source of each edge
+    targets: array with the integer index of the target of each edge
+    weights: array with the weight of each edge, or None
+    n_nodes: number of nodes of the graph
+
+    Returns
+    sources: sources of the edges of the component, relabelled from 0
+    targets: targets of the edges of the component, relabelled from 0
+    weights: weights of the edges of the component, None if not given
+    component_nodes: array with the original index of each node of the component
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    adjacency = coo_matrix((np.ones(len(sources), dtype=np.int8), (sources, targets)), shape=(n_nodes, n_nodes))
+    _, labels = connected_components(adjacency, directed=False)
+    giant = np.argmax(np.bincount(labels))
+
+    in_component = labels == giant
+    component_nodes = np.flatnonzero(in_component)
+    new_index = np.cumsum(in_component) - 1
+    keep = in_component[sources]
+    dtype = index_dtype(len(component_nodes))
+    if weights is not None:
+        weights = weights[keep]
+    return new_index[sources[keep]].astype(dtype), new_index[targets[keep]].astype(dtype), weights, component_nodes
+
+
+def degrees(graph):
+    """Function to calculate the degree of every node, a self-loop adds two to the degree
+    of an undirected node as in networkx
+    Parameters
+    graph: CSRGraph object
+
+    Returns
+    degree: array with the degree of each node
+    """
+    n_nodes = len(graph.nodes)
+    sources = edge_sources(graph)
+    if graph.directed:
+        return np.bincount(sources, minlength=n_nodes) + np.bincount(graph.indices, minlength=n_nodes)
+    self_loops = sources[sources == graph.indices]
+    return np.diff(graph.indptr) + np.bincount(self_loops, minlength=n_nodes)
+
+
+def adjacency_matrix(graph, binary=False):
+    """Function to get the scipy sparse adjacency matrix of the graph sharing the CSR arrays
+    Parameters
+    graph: CSRGraph object
+    binary: if True all the entries are one instead of the edge weights
+
+    Returns
+    adjacency: scipy csr_matrix where entry (i,j) is the edge from i to j
+    """
+    from scipy.sparse import csr_matrix
+
+    n_nodes = len(graph.nodes)
+    data = np.ones(len(graph.indices), dtype=np.int8) if binary else graph.weights
+    # The binary matrix is modified below, copy the arrays as they may be read-only memory maps
+    adjacency = csr_matrix((data, graph.indices, graph.indptr), shape=(n_nodes, n_nodes), copy=binary)
+    if binary:
+        # Repeated edges of multigraphs add up, keep a single one
+        adjacency.sum_duplicates()
+        adjacency.data[:] = 1
+    return adjacency
+
+
+def node_flows(graph):
+    """Function to calculate the degree and strength of every node in one pass over the edges
+    Parameters
+    graph: CSRGraph object
+
+    Returns
+    flows: dictionary with
+        nodes: list of node labels
+        node_index: dictionary with node labels as keys and their position in the arrays as values
+        in_degree, out_degree: arrays with the number of incoming and outgoing edges of each node
+        in_strength, out_strength: arrays with the total weight of the incoming and outgoing edges
+    """
+    n_nodes = len(graph.nodes)
+    sources, targets, weights = edge_arrays(graph)
+    return {"nodes": graph.nodes,
+            "node_index": graph.node_index,
+            "in_degree": np.bincount(targets, minlength=n_nodes),
+            "out_degree": np.bincount(sources, minlength=n_nodes),
+            "in_strength": np.bincount(targets, weights=weights, minlength=n_nodes),
+            "out_strength": np.bincount(sources, weights=weights, minlength=n_nodes)}
@@ -0,0 +1,159 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from graph_arrays import CSRGraph, csr_from_networkx
+from edge_store import is_edge_store, open_edge_store
+
+# Increase when the layout of the cached arrays changes
+CACHE_VERSION = 2
+CACHE_ARRAYS = ("indptr", "indices", "weights", "nodes")
+
+
+def file_hash(path, block_size=1 << 24):
+    """Function to calculate the sha256 hash of a file reading it by blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_path(network_file, cache_dir=None):
+    """Function to get the directory where the binary form of a network is stored
+    Parameters
+    network_file: path of the gml file
+    cache_dir: directory holding the caches, by default the one of the network file
+
+    Returns
+    path: directory of the cache of this network, named after the file and the hash of its
+    absolute path, so networks with the same name in different directories do not share it
+    """
+    network_file = os.path.abspath(network_file)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(network_file), ".graph_cache")
+    path_hash = hashlib.sha256(network_file.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{os.path.basename(network_file)}-{path_hash}")
+
+
+def write_json(data, file_name):
+    """Function to replace a json file atomically, writing a temporary file next to it first"""
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(file_name), suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, 'w') as f:
+            json.dump(data, f)
+        os.replace(temporary, file_name)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def read_cache(path, mmap=True):
+    """Function to read the CSR graph stored in a cache directory
+    Parameters
+    path: directory of the cache
+    mmap: if True the arrays are memory-mapped instead of read
+
+    Returns
+    graph: CSRGraph object
+    """
+    with open(os.path.join(path, "meta.json"), 'r') as f:
+        meta = json.load(f)
+    mmap_mode = 'r' if mmap else None
+    generation = os.path.join(path, meta["generation"])
+    arrays = {name: np.load(os.path.join(generation, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+              for name in CACHE_ARRAYS}
+    nodes = arrays["nodes"].tolist()
+    node_index = {node: i for i, node in enumerate(nodes)}
+    return CSRGraph(nodes, node_index, arrays["indptr"], arrays["indices"], arrays["weights"], meta["directed"])
+
+
+def write_cache(graph, path, meta):
+    """Function to store a CSR graph in a cache directory.
+    The arrays are written to a new generation directory and the metadata pointing to it
+    replaces the previous one atomically, so the files of the previous generation are never
+    rewritten while other processes may still have them memory-mapped. The previous
+    generation is then unlinked, which leaves the existing mappings valid
+    Parameters
+    graph: CSRGraph object
+    path: directory of the cache
+    meta: dictionary with the description of the source file
+    """
+    os.makedirs(path, exist_ok=True)
+    meta_file = os.path.join(path, "meta.json")
+    previous = None
+    if os.path.exists(meta_file):
+        try:
+            with open(meta_file, 'r') as f:
+                previous = json.load(f).get("generation")
+        except ValueError:
+            previous = None
+
+    generation = tempfile.mkdtemp(dir=path, prefix="generation-")
+    arrays = {"indptr": graph.indptr, "indices": graph.indices, "weights": graph.weights,
+              "nodes": np.array([str(node) for node in graph.nodes])}
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(generation, f"{name}.npy"), array, allow_pickle=False)
+        meta = dict(meta, version=CACHE_VERSION, directed=graph.directed, generation=os.path.basename(generation),
+                    n_nodes=len(graph.nodes), n_entries=len(graph.indices))
+        write_json(meta, meta_file)
+    except BaseException:
+        shutil.rmtree(generation, ignore_errors=True)
+        raise
+
+    if previous is not None and previous != meta["generation"]:
+        shutil.rmtree(os.path.join(path, previous), ignore_errors=True)
+
+
+def load_graph(network_file, cache_dir=None, use_cache=True, mmap=True):
+    """Function to load a gml network as a CSR graph, parsing the gml only once.
+    The binary form is reused while the size and modification time of the gml file
+    are unchanged, or while its content hash is unchanged if only the time differs
+    Parameters
+    network_file: path of the gml file
+    cache_dir: directory holding the caches, by default .graph_cache next to the network file
+    use_cache: if False the gml file is always parsed and nothing is stored
+    mmap: if True the cached arrays are memory-mapped
+
+    Returns
+    graph: CSRGraph object, node labels are strings as returned by networkx read_gml,
+    or the memory-mapped EdgeStore if network_file is an edge store directory
+    """
+    if is_edge_store(network_file):
+        return open_edge_store(network_file)
+
+    if not use_cache:
+        import networkx as nx
+        return csr_from_networkx(nx.read_gml(network_file))
+
+    path = cache_path(network_file, cache_dir)
+    meta_file = os.path.join(path, "meta.json")
+    stat = os.stat(network_file)
+
+    if os.path.exists(meta_file):
+        with open(meta_file, 'r') as f:
+            meta = json.load(f)
+        if meta.get("version") == CACHE_VERSION and meta["size"] == stat.st_size:
+            if meta["mtime_ns"] == stat.st_mtime_ns:
+                return read_cache(path, mmap=mmap)
+            if meta["sha256"] == file_hash(network_file):
+                # Same content with a new modification time, e.g. a copy
+                meta["mtime_ns"] = stat.st_mtime_ns
+                write_json(meta, meta_file)
+                return read_cache(path, mmap=mmap)
+
+    # networkx is only needed to parse the gml file, not to read the cache
+    import networkx as nx
+
+    graph = csr_from_networkx(nx.read_gml(network_file))
+    meta = {"source": os.path.abspath(network_file), "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns, "sha256": file_hash(network_file)}
+    try:
+        write_cache(graph, path, meta)
+    except OSError:
+        # The cache is an optimization, a read-only location only costs the parsing next time
+        return graph
+    return read_cache(path, mmap=mmap)
@@ -0,0 +1,191 @@
+import sys
+import json
+import time
+from functools import partial
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is then not recorded
+    resource = None
+
+
+def peak_rss_bytes():
+    """Function to get the peak resident memory of the process so far, None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes
+    return peak if sys.platform == "darwin" else peak*1024
+
+
+def measure_call(function, argument):
+    """Function to call a function measuring it in the process that runs it, so that a call
+    sent to a worker process reports the time and memory of the worker
+    Parameters
+    function: function of one argument, it must be picklable to be sent to a pool
+    argument: argument of the call
+
+    Returns
+    result: value returned by the call
+    measurement: dictionary with the wall_seconds and cpu_seconds of the call and the
+    peak_rss_bytes of the process that ran it
+    """
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    result = function(argument)
+    return result, {"wall_seconds": time.perf_counter() - start_wall,
+                    "cpu_seconds": time.process_time() - start_cpu,
+                    "peak_rss_bytes": peak_rss_bytes()}
+
+
+class NullRecorder:
+    """Recorder that records nothing, the default of every analysis so that
+    the instrumentation costs nothing when it is not wanted"""
+
+    enabled = False
+    # Stage record shared by all the stages, whatever is written in it is discarded
+    _discarded = {}
+
+    @contextmanager
+    def stage(self, name, **fields):
+        yield self._discarded
+
+    def iterate(self, name, iterable, **fields):
+        return iterable
+
+    def map(self, name, function, arguments, map_function=map, **fields):
+        return map_function(function, arguments)
+
+    def close(self):
+        pass
+
+
+NULL_RECORDER = NullRecorder()
+
+
+class Recorder(NullRecorder):
+    """Recorder of the wall time, CPU time, peak resident memory and number of items of every
+    stage of an analysis. Each stage is kept in records, written as one json line to the
+    log file and passed to the progress function as soon as it ends
+    Parameters
+    log_file: optional path of the jsonl log, appended to
+    progress: optional function called with the record of every stage
+    """
+
+    enabled = True
+
+    def __init__(self, log_file=None, progress=None):
+        self.records = []
+        self.progress = progress
+        self.log = open(log_file, 'a') if log_file is not None else None
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _start(self, name, fields):
+        record = {"stage": name, "items": None}
+        record.update(fields)
+        return record, time.perf_counter(), time.process_time()
+
+    def _finish(self, record, start_wall, start_cpu):
+        record["wall_seconds"] = time.perf_counter() - start_wall
+        record["cpu_seconds"] = time.process_time() - start_cpu
+        record["peak_rss_bytes"] = peak_rss_bytes()
+        self._emit(record)
+
+    def _emit(self, record):
+        record["time"] = time.time()
+        self.records.append(record)
+        if self.log is not None:
+            self.log.write(json.dumps(record) + "\n")
+            self.log.flush()
+        if self.progress is not None:
+            self.progress(record)
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """Context manager measuring one stage. It yields the record of the stage, where
+        the stage can set the number of items it processed under "items" or any other field
+        Parameters
+        name: name of the stage
+        fields: extra fields of the record, e.g. the replicate number
+        """
+        record, start_wall, start_cpu = self._start(name, fields)
+        try:
+            yield record
+        finally:
+            self._finish(record, start_wall, start_cpu)
+
+    def iterate(self, name, iterable, **fields):
+        """Generator over an iterable recording the production of every item as one stage,
+        with the position of the item under "index". The time and memory are those of this
+        process waiting for the item, use map for items computed by worker processes
+        Parameters
+        name: name of the stages
+        iterable: iterable to go through
+        fields: extra fields of every record
+        """
+        iterator = iter(iterable)
+        index = 0
+        while True:
+            record, start_wall, start_cpu = self._start(name, dict(fields, index=index))
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            record["items"] = 1
+            self._finish(record, start_wall, start_cpu)
+            yield item
+            index += 1
+
+    def map(self, name, function, arguments, map_function=map, **fields):
+        """Generator over the results of a function applied to every argument, recording every
+        call as one stage with the position of the argument under "index". Each call is measured
+        by measure_call in the process that runs it, so with the imap of a pool the records hold
+        the wall time, CPU time and peak memory of the worker and not the wait of this process
+        Parameters
+        name: name of the stages
+        function: picklable function of one argument
+        arguments: iterable with the arguments
+        map_function: function called as map_function(function, arguments), e.g. pool.imap
+        fields: extra fields of every record
+        """
+        calls = map_function(partial(measure_call, function), arguments)
+        for index, (result, measurement) in enumerate(calls):
+            record = {"stage": name, "items": 1}
+            record.update(fields)
+            record["index"] = index
+            record.update(measurement)
+            self._emit(record)
+            yield result
+
+    def summary(self):
+        """Dictionary with the total wall and CPU time, number of calls and items of every stage"""
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record["stage"], {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                                        "items": 0, "peak_rss_bytes": None})
+            total["calls"] += 1
+            total["wall_seconds"] += record["wall_seconds"]
+            total["cpu_seconds"] += record["cpu_seconds"]
+            total["items"] += record["items"] or 0
+            total["peak_rss_bytes"] = record["peak_rss_bytes"]
+        return totals
+
+
+def print_progress(record):
+    """Progress function writing one line per stage to the standard error"""
+    items = f" {record['items']} items" if record.get("items") is not None else ""
+    index = f" {record['index']}" if "index" in record else ""
+    memory = f" {record['peak_rss_bytes']/2**20:.0f} MiB" if record.get("peak_rss_bytes") is not None else ""
+    print(f"{record['stage']}{index}: {record['wall_seconds']:.3f} s wall {record['cpu_seconds']:.3f} s cpu"
+          f"{items}{memory}", file=sys.stderr, flush=True)
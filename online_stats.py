@@ -0,0 +1,195 @@
+import math
+import numpy as np
+
+# Two-sided 95% normal critical value
+Z_CRITICAL = 1.959963984540054
+
+
+class P2Quantile:
+    """Streaming estimate of a quantile with the P-square algorithm of Jain and Chlamtac.
+    Keeps five markers whatever the number of observations
+    Parameters
+    p: quantile to estimate, between 0 and 1
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2*p, 1 + 4*p, 3 + 2*p, 5]
+        self.increments = [0, p/2, p, (1 + p)/2, 1]
+
+    def update(self, x):
+        self.count += 1
+        if len(self.heights) < 5:
+            self.heights.append(x)
+            self.heights.sort()
+            return
+
+        heights = self.heights
+        positions = self.positions
+        # Find the cell of the new observation and move the extreme markers if needed
+        if x < heights[0]:
+            heights[0] = x
+            k = 0
+        elif x >= heights[4]:
+            heights[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= heights[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Adjust the three middle markers
+        for i in range(1, 4):
+            d = self.desired[i] - positions[i]
+            if (d >= 1 and positions[i + 1] - positions[i] > 1) or (d <= -1 and positions[i - 1] - positions[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + d*(heights[i + d] - heights[i])/(positions[i + d] - positions[i])
+                heights[i] = height
+                positions[i] += d
+
+    def _parabolic(self, i, d):
+        q = self.heights
+        n = self.positions
+        return q[i] + d/(n[i + 1] - n[i - 1])*((n[i] - n[i - 1] + d)*(q[i + 1] - q[i])/(n[i + 1] - n[i])
+                                               + (n[i + 1] - n[i] - d)*(q[i] - q[i - 1])/(n[i] - n[i - 1]))
+
+    def value(self):
+        """Current estimate of the quantile"""
+        if not self.heights:
+            return float("nan")
+        if self.count <= 5:
+            # Exact quantile of the few observations seen so far
+            position = self.p*(len(self.heights) - 1)
+            lower = int(math.floor(position))
+            upper = min(lower + 1, len(self.heights) - 1)
+            return self.heights[lower] + (position - lower)*(self.heights[upper] - self.heights[lower])
+        return self.heights[2]
+
+
+class OnlineStatistics:
+    """Streaming summary of the randomized values of a metric compared with its real value.
+    Mean and variance are updated with Welford's algorithm and the quantiles with P-square sketches
+    Parameters
+    real_value: value of the metric in the real network
+    quantiles: quantiles to track
+    """
+
+    def __init__(self, real_value, quantiles=(0.025, 0.5, 0.975)):
+        self.real_value = real_value
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        # Number of randomized values at or above, and at or below, the real value
+        self.n_above = 0
+        self.n_below = 0
+        self.quantiles = {q: P2Quantile(q) for q in quantiles}
+
+    def update(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta/self.n
+        self.m2 += delta*(x - self.mean)
+        if x >= self.real_value:
+            self.n_above += 1
+        if x <= self.real_value:
+            self.n_below += 1
+        for sketch in self.quantiles.values():
+            sketch.update(x)
+
+    def std(self):
+        """Sample standard deviation of the randomized values"""
+        if self.n < 2:
+            return float("nan")
+        return math.sqrt(self.m2/(self.n - 1))
+
+    def z_score(self):
+        """Z-score of the real value with respect to the randomized values"""
+        std = self.std()
+        if not std > 0:
+            return float("nan")
+        return (self.real_value - self.mean)/std
+
+    def z_halfwidth(self):
+        """Half-width of the 95% confidence interval of the z-score due to the finite
+        number of replicates. Uses the delta-method standard error sqrt((1+z^2/2)/n)
+        of a z-score estimated from a sample mean and standard deviation"""
+        z = self.z_score()
+        if math.isnan(z):
+            return float("inf")
+        return Z_CRITICAL*math.sqrt((1 + z*z/2)/self.n)
+
+    def resolved(self, tolerance):
+        """Function to check if the z-score is known within a tolerance. The half-width of its
+        confidence interval grows with |z|, so it is compared with tolerance*|z| above |z| = 1
+        and with tolerance below. Randomized values that do not vary give an infinite or
+        undefined z-score whatever the number of replicates, so the metric is resolved"""
+        if self.n >= 2 and not self.m2 > 0:
+            return True
+        z = self.z_score()
+        if math.isnan(z):
+            return False
+        return self.z_halfwidth() < tolerance*max(1.0, abs(z))
+
+    def p_value(self):
+        """Two-sided p-value of the real value under a normal approximation of the randomized values"""
+        z = self.z_score()
+        if math.isnan(z):
+            return float("nan")
+        return math.erfc(abs(z)/math.sqrt(2))
+
+    def empirical_p_value(self):
+        """Two-sided empirical p-value of the real value, counting the randomized
+        values at least as extreme"""
+        return min(1.0, 2*(min(self.n_above, self.n_below) + 1)/(self.n + 1))
+
+    def summary(self):
+        """Dictionary with the current statistics"""
+        z = self.z_score()
+        halfwidth = self.z_halfwidth()
+        return {"n_replicates": self.n
+                , "mean": self.mean
+                , "std": self.std()
+                , "quantiles": {q: sketch.value() for q, sketch in self.quantiles.items()}
+                , "z_score": z
+                , "z_interval": [z - halfwidth, z + halfwidth]
+                , "p_value": self.p_value()
+                , "empirical_p_value": self.empirical_p_value()}
+
+
+def converged(statistics, tolerance, min_replicates=20):
+    """Function to decide if the randomized ensemble can stop
+    Parameters
+    statistics: dictionary with metrics as keys and OnlineStatistics as values
+    tolerance: maximum half-width of the confidence interval of every z-score, relative to
+    |z| when |z| is above 1, see OnlineStatistics.resolved
+    min_replicates: minimum number of replicates before stopping
+
+    Returns
+    stop: True if every z-score is known within the tolerance
+    """
+    return all(stats.n >= min_replicates and stats.resolved(tolerance) for stats in statistics.values())
+
+
+def replicate_seeds(n_replicates, seed=None):
+    """Function to derive one independent seed per replicate from a base seed.
+    The seeds depend only on the base seed and the replicate number, so the
+    ensemble gives the same results for any number of workers
+    Parameters
+    n_replicates: number of replicates
+    seed: base seed, if None a random one is drawn
+
+    Returns
+    seeds: list of integer seeds, one per replicate
+    """
+    children = np.random.SeedSequence(seed).spawn(n_replicates)
+    # METIS takes a signed 32 bit seed
+    return [int(child.generate_state(1)[0] & 0x7fffffff) for child in children]
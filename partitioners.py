@@ -0,0 +1,246 @@
+import numpy as np
+from graph_arrays import edge_arrays, edge_sources
+
+
+def metis_arrays_from_csr(graph, weighted=False):
+    """Function to build the METIS adjacency arrays of an undirected CSR graph, plain numpy
+    arrays that can be sent to worker processes and reused for many partitions
+    Parameters
+    graph: undirected CSRGraph
+    weighted: if True the edge weights, rounded to integers, are kept for METIS
+
+    Returns
+    xadj, adjncy: METIS adjacency of the graph without self-loops nor repeated neighbours
+    adjwgt: integer weight of each entry of adjncy, None if not weighted
+    """
+    import metis
+
+    n_nodes = len(graph.nodes)
+    sources = edge_sources(graph)
+    targets = graph.indices
+
+    # METIS needs an adjacency without self-loops nor repeated neighbours
+    keep = sources != targets
+    pair_keys, pair_index = np.unique(sources[keep].astype(np.int64)*n_nodes + targets[keep], return_inverse=True)
+    sources, targets = np.divmod(pair_keys, n_nodes)
+
+    idx_dtype = np.dtype(metis.idx_t)
+    xadj = np.zeros(n_nodes + 1, dtype=idx_dtype)
+    np.cumsum(np.bincount(sources, minlength=n_nodes), out=xadj[1:])
+    adjncy = np.ascontiguousarray(targets, dtype=idx_dtype)
+    adjwgt = None
+    if weighted:
+        pair_weights = np.bincount(pair_index, weights=graph.weights[keep], minlength=len(pair_keys))
+        adjwgt = np.maximum(np.rint(pair_weights), 1).astype(idx_dtype)
+    return xadj, adjncy, adjwgt
+
+
+def metis_graph_from_arrays(xadj, adjncy, adjwgt=None):
+    """Function to wrap METIS adjacency arrays as the METIS input without copying them
+    Parameters
+    xadj, adjncy, adjwgt: arrays from metis_arrays_from_csr
+
+    Returns
+    metis_graph: METIS_Graph named tuple sharing memory with the numpy arrays
+    """
+    import metis
+
+    if adjwgt is not None:
+        adjwgt = (metis.idx_t*len(adjwgt)).from_buffer(adjwgt)
+    return metis.METIS_Graph(metis.idx_t(len(xadj) - 1), metis.idx_t(1),
+                             (metis.idx_t*len(xadj)).from_buffer(xadj),
+                             (metis.idx_t*len(adjncy)).from_buffer(adjncy),
+                             None, None, adjwgt)
+
+
+def metis_graph_from_csr(graph, weighted=False):
+    """Function to build the METIS input directly from the arrays of an undirected CSR graph
+    Parameters
+    graph: undirected CSRGraph
+    weighted: if True the edge weights, rounded to integers, are passed to METIS
+
+    Returns
+    metis_graph: METIS_Graph named tuple sharing memory with numpy arrays
+    """
+    return metis_graph_from_arrays(*metis_arrays_from_csr(graph, weighted=weighted))
+
+
+def metis_part_graph(metis_graph, nparts=2, seed=None):
+    """Function to partition a METIS graph
+    Parameters
+    metis_graph: METIS_Graph from metis_graph_from_arrays or metis_graph_from_csr
+    nparts: number of parts
+    seed: optional seed for the METIS partitioner
+
+    Returns
+    parts: array with the part of each node
+    """
+    import metis
+
+    if seed is None:
+        partition = metis.part_graph(metis_graph, nparts)
+    else:
+        partition = metis.part_graph(metis_graph, nparts, seed=seed)
+    return np.asarray(partition[1], dtype=np.int64)
+
+
+def metis_partition(graph, nparts=2, seed=None, weighted=False):
+    """Function to partition an undirected CSR graph with METIS
+    Parameters
+    graph: undirected CSRGraph
+    nparts: number of parts
+    seed: optional seed for the METIS partitioner
+    weighted: if True the edge weights are taken into account
+
+    Returns
+    parts: array with the part of each node in the order of the graph nodes
+    """
+    return metis_part_graph(metis_graph_from_csr(graph, weighted=weighted), nparts=nparts, seed=seed)
+
+
+def adjacency_without_loops(graph, weighted=False):
+    """Function to get the symmetric sparse adjacency of an undirected CSR graph without self-loops
+    Parameters
+    graph: undirected CSRGraph
+    weighted: if False every stored edge counts 1
+
+    Returns
+    adjacency: scipy csr matrix
+    """
+    from scipy import sparse
+
+    n_nodes = len(graph.nodes)
+    sources = edge_sources(graph)
+    keep = sources != graph.indices
+    data = graph.weights[keep].astype(np.float64) if weighted else np.ones(int(keep.sum()))
+    return sparse.csr_matrix((data, (sources[keep], graph.indices[keep])), shape=(n_nodes, n_nodes))
+
+
+def spectral_partition(graph, nparts=2, seed=None, weighted=False):
+    """Function to split an undirected CSR graph in two halves with the Fiedler vector
+    of its normalized Laplacian, found with the sparse eigensolver
+    Parameters
+    graph: undirected CSRGraph, connected as the graphs of polarization.process_graph
+    nparts: number of parts, only 2 is supported
+    seed: optional seed of the starting vector of the eigensolver
+    weighted: if True the edge weights are taken into account
+
+    Returns
+    parts: array with the part of each node in the order of the graph nodes
+    """
+    from scipy import sparse
+    from scipy.sparse import linalg as sparse_linalg
+
+    if nparts != 2:
+        raise ValueError("Spectral bisection only splits the graph in 2 parts")
+    n_nodes = len(graph.nodes)
+    parts = np.zeros(n_nodes, dtype=np.int64)
+    if n_nodes < 2:
+        return parts
+
+    adjacency = adjacency_without_loops(graph, weighted=weighted)
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    inverse_sqrt_degree = 1/np.sqrt(np.where(degree > 0, degree, 1))
+    # The largest eigenvectors of D^-1/2 A D^-1/2 are the smallest ones of the normalized Laplacian
+    normalized = sparse.diags(inverse_sqrt_degree) @ adjacency @ sparse.diags(inverse_sqrt_degree)
+    if n_nodes <= 3:
+        _, vectors = np.linalg.eigh(normalized.toarray())
+    else:
+        v0 = np.random.default_rng(seed).uniform(0.5, 1.5, size=n_nodes)
+        _, vectors = sparse_linalg.eigsh(normalized, k=2, which="LA", v0=v0)
+    fiedler = vectors[:, -2]*inverse_sqrt_degree
+
+    # Split at the median, as METIS the two parts have the same size
+    parts[np.argsort(fiedler, kind="stable")[n_nodes//2:]] = 1
+    return parts
+
+
+def cut_weight(sources, targets, weights, parts):
+    """Function to sum the weight of the edges between parts"""
+    return float(weights[parts[sources] != parts[targets]].sum())
+
+
+def kernighan_lin_refine(graph, parts, weighted=False, max_passes=20):
+    """Function to improve a bisection with Kernighan-Lin swaps.
+    Every pass swaps, in decreasing order of gain, pairs of nodes of the two parts that
+    have more edges to the other part than to their own, halving the number of pairs
+    until the cut decreases, so the sizes of the parts never change
+    Parameters
+    graph: undirected CSRGraph
+    parts: array with the part, 0 or 1, of each node
+    weighted: if True the edge weights are taken into account
+    max_passes: maximum number of passes
+
+    Returns
+    parts: refined array with the part of each node
+    """
+    parts = np.array(parts, dtype=np.int64)
+    adjacency = adjacency_without_loops(graph, weighted=weighted)
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    sources, targets, weights = edge_arrays(graph)
+    if not weighted:
+        weights = np.ones(len(sources))
+    cut = cut_weight(sources, targets, weights, parts)
+
+    for _ in range(max_passes):
+        to_part_one = adjacency @ parts.astype(np.float64)
+        internal = np.where(parts == 1, to_part_one, degree - to_part_one)
+        gain = degree - 2*internal
+
+        candidates = []
+        for part in (0, 1):
+            nodes = np.flatnonzero((parts == part) & (gain > 0))
+            candidates.append(nodes[np.argsort(-gain[nodes], kind="stable")])
+        n_swap = min(len(candidates[0]), len(candidates[1]))
+
+        improved = False
+        while n_swap > 0:
+            trial = parts.copy()
+            trial[candidates[0][:n_swap]] = 1
+            trial[candidates[1][:n_swap]] = 0
+            trial_cut = cut_weight(sources, targets, weights, trial)
+            if trial_cut < cut:
+                parts, cut, improved = trial, trial_cut, True
+                break
+            n_swap //= 2
+        if not improved:
+            break
+    return parts
+
+
+def metis_kl_partition(graph, nparts=2, seed=None, weighted=False):
+    """Function to partition with METIS and refine the bisection with Kernighan-Lin swaps, see metis_partition"""
+    parts = metis_partition(graph, nparts=nparts, seed=seed, weighted=weighted)
+    if nparts != 2:
+        return parts
+    return kernighan_lin_refine(graph, parts, weighted=weighted)
+
+
+def spectral_kl_partition(graph, nparts=2, seed=None, weighted=False):
+    """Function to bisect with the Fiedler vector and refine with Kernighan-Lin swaps, see spectral_partition"""
+    parts = spectral_partition(graph, nparts=nparts, seed=seed, weighted=weighted)
+    return kernighan_lin_refine(graph, parts, weighted=weighted)
+
+
+# Backends taking an undirected CSRGraph and returning the part of each node
+PARTITIONERS = {"metis": metis_partition,
+                "metis_kl": metis_kl_partition,
+                "spectral": spectral_partition,
+                "spectral_kl": spectral_kl_partition}
+
+
+def partition_graph(graph, method="metis", nparts=2, seed=None, weighted=False):
+    """Function to partition an undirected CSR graph with one of the PARTITIONERS
+    Parameters
+    graph: undirected CSRGraph
+    method: name of the backend in PARTITIONERS
+    nparts: number of parts
+    seed: optional seed of the backend
+    weighted: if True the edge weights are taken into account
+
+    Returns
+    parts: array with the part of each node in the order of the graph nodes
+    """
+    if method not in PARTITIONERS:
+        raise ValueError(f"Unknown partitioner {method}, the available ones are {', '.join(PARTITIONERS)}")
+    return PARTITIONERS[method](graph, nparts=nparts, seed=seed, weighted=weighted)
@@ -1,72 +1,145 @@
 import os
-import sys
-import networkx as nx
-import metis
 import json
-import pandas as pd
+import argparse
+import multiprocessing
 import numpy as np
-import pickle
-import glob
-import matplotlib.pyplot as plt
-def krackhardt_ratio_pol(G, ms):
-    """Computes EI-Index Polarization"""
-    EL = 0
-    IL = 0
-
-    for e in G.edges(data=True):
-        s, t, w = e
-
-        if ms[s] != ms[t]:
-            EL += w["weight"]
-        else:
-            IL += w["weight"]
-
+from online_stats import OnlineStatistics, converged, replicate_seeds
+from graph_cache import load_graph
+from edge_store import EdgeStore, store_block_contingency
+from instrumentation import NULL_RECORDER, Recorder, print_progress
+from partitioners import PARTITIONERS, metis_arrays_from_csr, metis_graph_from_arrays, metis_part_graph, partition_graph
+from graph_arrays import CSRGraph, as_csr, csr_from_edges, edge_arrays, degrees, index_dtype, largest_component, largest_component_edges, node_values, nodes_dict
+def block_contingency(G, ms, n_blocks=2):
+    """Function to collect in a single pass over the edges everything the
+    polarization metrics need from a partition
+    Parameters
+    G: networkx graph object, CSRGraph or EdgeStore, read by chunks
+    ms: dictionary with nodes as keys and the block (0 to n_blocks-1) as value,
+    or array with the block of each node in the order of the graph nodes
+    n_blocks: number of blocks of the partition
+
+    Returns
+    contingency: dictionary with
+        edge_counts: n_blocks x n_blocks array with the number of edges from each block to each block
+        edge_weights: n_blocks x n_blocks array with the weight of the edges from each block to each block
+        block_sizes: array with the number of nodes of each block
+        directed: True if the graph is directed
+    The degree sums of each block follow from the edge counts, the out-degree of
+    a block is the sum of its row and the in-degree the sum of its column
+    """
+    graph = G if isinstance(G, EdgeStore) else as_csr(G)
+    if isinstance(ms, dict):
+        blocks = node_values(graph, ms)
+        block_sizes = np.bincount(np.fromiter(ms.values(), dtype=np.int64, count=len(ms)), minlength=n_blocks)
+    else:
+        blocks = np.asarray(ms)
+        block_sizes = np.bincount(blocks, minlength=n_blocks)
+    if isinstance(graph, EdgeStore):
+        return store_block_contingency(graph, blocks, n_blocks=n_blocks, block_sizes=block_sizes)
+    sources, targets, weights = edge_arrays(graph)
+    return edge_contingency(sources, targets, weights, blocks, n_blocks, graph.directed, block_sizes=block_sizes)
+
+def edge_contingency(sources, targets, weights, blocks, n_blocks=2, directed=False, block_sizes=None):
+    """Function to calculate the block contingency of block_contingency from the edge arrays
+    of the graph, so that many partitions of the same graph reuse them
+    Parameters
+    sources, targets, weights: edge arrays of the graph from graph_arrays.edge_arrays
+    blocks: array with the block of each node
+    n_blocks: number of blocks of the partition
+    directed: True if the graph is directed
+    block_sizes: optional array with the number of nodes of each block, counted from blocks by default
+
+    Returns
+    contingency: dictionary with edge_counts, edge_weights, block_sizes and directed
+    """
+    # Index of the pair of blocks (s,t) of each edge
+    pair_index = n_blocks*blocks[sources]+blocks[targets]
+    edge_counts = np.bincount(pair_index, minlength=n_blocks*n_blocks)
+    edge_weights = np.bincount(pair_index, weights=weights, minlength=n_blocks*n_blocks)
+    if block_sizes is None:
+        block_sizes = np.bincount(blocks, minlength=n_blocks)
+
+    return {"edge_counts":edge_counts.reshape(n_blocks,n_blocks)
+            ,"edge_weights":edge_weights.reshape(n_blocks,n_blocks)
+            ,"block_sizes":block_sizes
+            ,"directed":directed}
+
+def contingency_ei_index(contingency):
+    """Computes EI-Index Polarization from the block contingency, with any number of blocks
+    the internal links are those inside a block and the external ones those between blocks"""
+    edge_weights = contingency["edge_weights"]
+    IL = np.trace(edge_weights)
+    EL = edge_weights.sum() - IL
+
+    return float((EL-IL)/(EL+IL))
+
+def contingency_extended_ei_index(contingency):
+    """Computes Extended EI-Index Polarization from the block contingency. The link density
+    inside and between blocks is compared, with k blocks the mean of the k internal densities
+    against the mean of the k(k-1) external ones, which for two blocks is the original index"""
+    block_sizes = np.asarray(contingency["block_sizes"],dtype=np.float64)
+    n_blocks = len(block_sizes)
+    pairs = np.outer(block_sizes,block_sizes)
+    np.fill_diagonal(pairs,block_sizes*(block_sizes-1)*0.5)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        density = contingency["edge_weights"][:n_blocks,:n_blocks]/pairs
+        internal = np.diag(density)/n_blocks
+        external = density[~np.eye(n_blocks,dtype=bool)]/(n_blocks*(n_blocks-1))
+
+        # Summed term by term, as B_aa+B_bb-B_ab-B_ba for two blocks
+        return float(-sum([*internal,*-external])/sum([*internal,*external]))
+
+def contingency_modularity(contingency,weighted=False):
+    """Computes the modularity of the partition from the block contingency, as networkx
+    modularity with weight=None, or with the edge weights if weighted"""
+    edge_counts = contingency["edge_weights" if weighted else "edge_counts"]
+    out_degree = edge_counts.sum(axis=1)
+    in_degree = edge_counts.sum(axis=0)
+    m = edge_counts.sum()
+    if contingency["directed"]:
+        expected = out_degree*in_degree/m**2
+    else:
+        # Each undirected edge adds one to the degree of both ends
+        expected = ((out_degree+in_degree)/(2*m))**2
+
+    return float(np.sum(np.diag(edge_counts)/m - expected))
+
+def contingency_conductance(contingency,weighted=False):
+    """Computes the conductance between the two blocks from the block contingency, as
+    networkx conductance with weight=None, or with the edge weights if weighted"""
+    edge_counts = contingency["edge_weights" if weighted else "edge_counts"]
+    cut = edge_counts[0,1]+edge_counts[1,0]
+    if contingency["directed"]:
+        volume = edge_counts.sum(axis=1)
+    else:
+        volume = edge_counts.sum(axis=1)+edge_counts.sum(axis=0)
+
+    return float(cut/min(volume[0],volume[1]))
 
-    return (EL-IL)/(EL+IL)
+def krackhardt_ratio_pol(G, ms):
+    """Computes EI-Index Polarization
+    G: networkx graph object or CSRGraph
+    ms: dictionary with nodes as keys and the block as value
+    """
+    n_blocks = max(ms.values())+1
+    return contingency_ei_index(block_contingency(G, ms, n_blocks))
 
 def extended_krackhardt_ratio_pol(G, ms):
-    """Computes Extended EI-Index Polarization"""
-
-    block_a = [k for k in ms if ms[k] == 0]
-    block_b = [k for k in ms if ms[k] == 1]
-
-    n_a = len(block_a)
-    n_b = len(block_b)
-
-
-    c_ab = 0
-    c_ba = 0
-    c_bb=0
-    c_aa=0
-
-    for e in G.edges(data=True):
-        s, t, w = e
-        if ms[s] != ms[t]:
-            if ms[s]==0:
-                c_ab += w["weight"]
-            else:
-                c_ba += w["weight"]
-
-        else:
-            if ms[s]==0:
-                c_aa += w["weight"]
-
-            if ms[s]==1:
-                c_bb += w["weight"]
-
-
-    B_aa = (c_aa)/(n_a*(n_a-1)*0.5)
-    B_bb = (c_bb)/(n_b*(n_b-1)*0.5)
-    B_ab = (c_ab)/(n_a*n_b)
-    B_ba = (c_ba)/(n_a*n_b)
-
-    return -(B_aa+B_bb-B_ab-B_ba)/(B_aa+B_bb+B_ab+B_ba)
+    """Computes Extended EI-Index Polarization
+    G: networkx graph object or CSRGraph
+    ms: dictionary with nodes as keys and the block as value
+    """
+    n_blocks = max(ms.values())+1
+    return contingency_extended_ei_index(block_contingency(G, ms, n_blocks))
 
 
-def two_communities_partition(G):
+def two_communities_partition(G,seed=None,partitioner="metis",nparts=2):
     """Function to calculate the split of the network in two graphs
     Parameters:
-    G: networkx graph object
+    G: networkx graph object or undirected CSRGraph
+    seed: optional seed for the partitioner
+    partitioner: name of the partitioner in partitioners.PARTITIONERS
+    nparts: number of parts, only METIS splits in more than two
 
     Return:
     metis_community: dictionary with nodes as keys and the community as value
@@ -74,78 +147,375 @@ def two_communities_partition(G):
     of modularity and conductance
     """
 
-    G_temporal=G.copy()
-    G_temporal.graph['edge_weight_attr'] = 'weight'
-    metis_graph=metis.networkx_to_metis(G_temporal)
-    partition=metis.part_graph(metis_graph)
-    H = nx.convert_node_labels_to_integers(G_temporal,label_attribute='old_label')
-    community_correspondance={}
-    metis_community={}
-    metis_nodes={}
-    for node in H.nodes():
-            label_node=H.nodes[node]["old_label"]
-            metis_community[label_node]=partition[1][node]
-            metis_nodes[partition[1][node]]=metis_nodes.setdefault(partition[1][node],{})
-            metis_nodes[partition[1][node]][label_node]=1
-
-    partition_array=[]
-    for community in metis_nodes:
-        list1=[]
-        for node in metis_nodes[community]:
-            list1.append(node)
-        partition_array.append(set(list1))
+    graph = as_csr(G)
+    parts = partition_graph(graph,method=partitioner,nparts=nparts,seed=seed)
+    metis_community = nodes_dict(graph,parts)
+
+    partition_array=[set() for _ in range(nparts)]
+    for node,part in metis_community.items():
+        partition_array[part].add(node)
 
     return metis_community,partition_array
 
 
-def calculate_polarization_metrics(G,partition_array,community_dict):
-    """Fuction to calculate the polarization metrics
+def calculate_polarization_metrics(G,partition_array,community_dict,weighted=False):
+    """Fuction to calculate the polarization metrics.
+    All of them come from the block contingency, so the graph is scanned only once
     params
-    G: networkx graph object of the graph
-    partition_array: array of node partition as required by modularity and conductance
-    community_dict: dictionary with nodes as keys and the community as value
+    G: networkx graph object or CSRGraph of the graph
+    partition_array: array of node partition, kept for compatibility as the blocks
+    are taken from community_dict
+    community_dict: dictionary with nodes as keys and the community as value, or array
+    with the community of each node in the order of the graph nodes
+    weighted: if True modularity and conductance use the edge weights, the E-I indices
+    always do. Directed graphs give the directed versions of the metrics
 
     returns
     pol_metrics: dictionary with the main polarization metrics
     """
 
-    modularity = nx.community.modularity(G, partition_array,weight=None)
-    conductance = 1 - nx.conductance(G, partition_array[0], partition_array[1],weight=None)
-    ei_index=krackhardt_ratio_pol(G,community_dict)
-    ei_index_extended=extended_krackhardt_ratio_pol(G,community_dict)
+    contingency = block_contingency(G,community_dict)
+    return dict(zip(METRIC_NAMES,contingency_metrics(contingency,weighted=weighted)))
+
+def contingency_metrics(contingency,weighted=False):
+    """Function to calculate the polarization metrics from the block contingency
+    Parameters
+    contingency: dictionary from block_contingency
+    weighted: if True modularity and conductance use the edge weights
+
+    Returns
+    metrics: tuple with the polarization metrics in the order given by METRIC_NAMES
+    """
+    return (contingency_modularity(contingency,weighted=weighted)
+            ,1 - contingency_conductance(contingency,weighted=weighted)
+            ,contingency_ei_index(contingency)
+            ,contingency_extended_ei_index(contingency))
+
+def configuration_edges(degree_sequence,seed=None,remove_self_loops=False,remove_multi_edges=False):
+    """Function to generate the edges of a configuration-model graph by random stub
+    matching, keeping only the largest connected component
+    Params
+    degree_sequence: degree of each node
+    seed: optional seed or numpy Generator for the random stub matching
+    remove_self_loops: if True self-loops are removed
+    remove_multi_edges: if True repeated edges are kept only once
 
-    dict_metrics={"modularity":modularity
-                  ,"conductance":conductance
-                  ,"ei_index":ei_index
-                  ,"ei_index_extended":ei_index_extended}
-    return dict_metrics
+    returns
+    sources: array with the source of each edge, relabelled from 0 within the component
+    targets: array with the target of each edge, relabelled from 0 within the component
+    component_nodes: array with the position in degree_sequence of each node of the component
+    """
+    degree_sequence = np.asarray(degree_sequence,dtype=np.int64)
+    if degree_sequence.sum()%2 != 0:
+        raise ValueError("Invalid degree sequence: sum of degrees must be even")
+    n_nodes = len(degree_sequence)
+    rng = np.random.default_rng(seed)
+
+    # Each node appears once per stub, consecutive stubs of the shuffled array are joined
+    stubs = np.repeat(np.arange(n_nodes,dtype=index_dtype(n_nodes)),degree_sequence)
+    rng.shuffle(stubs)
+    sources = stubs[0::2]
+    targets = stubs[1::2]
+
+    if remove_self_loops:
+        keep = sources != targets
+        sources = sources[keep]
+        targets = targets[keep]
+    if remove_multi_edges:
+        lower = np.minimum(sources,targets).astype(np.int64)
+        upper = np.maximum(sources,targets).astype(np.int64)
+        _, first = np.unique(lower*n_nodes+upper,return_index=True)
+        first.sort()
+        sources = sources[first]
+        targets = targets[first]
+
+    # Keep the largest connected component
+    return largest_component(sources,targets,n_nodes)
+
+def weight_stubs(sources,targets,weights):
+    """Function to split every edge of integer weight w into w edges of weight 1, the stubs
+    of the strength-preserving configuration models
+    Params
+    sources, targets: edge arrays of the graph
+    weights: array with the weight of each edge, or None for edges of weight 1
 
-def generate_configuration_graph(degree_sequence,original_sequence):
+    returns
+    sources, targets: one entry per unit of weight
+    """
+    if weights is None:
+        return sources, targets
+    units = np.rint(weights).astype(np.int64)
+    if np.any(units < 1) or not np.allclose(units,weights):
+        raise ValueError("Strength-preserving randomization needs positive integer weights, shuffle the weights instead")
+    return np.repeat(sources,units), np.repeat(targets,units)
+
+def merge_weight_stubs(sources,targets,n_nodes,directed):
+    """Function to merge the repeated edges of weight 1 back into weighted edges
+    Params
+    sources, targets: edge arrays with one entry per unit of weight
+    n_nodes: number of nodes
+    directed: if False an edge and its reverse are the same edge
+
+    returns
+    sources, targets, weights: one edge per pair of nodes, weighing its number of repetitions
+    """
+    sources = sources.astype(np.int64)
+    targets = targets.astype(np.int64)
+    if not directed:
+        sources, targets = np.minimum(sources,targets), np.maximum(sources,targets)
+    pair_keys, counts = np.unique(sources*n_nodes+targets,return_counts=True)
+    sources, targets = np.divmod(pair_keys,n_nodes)
+    return sources, targets, counts.astype(np.float32)
+
+def directed_configuration_edges(sources,targets,weights,n_nodes,seed=None,preserve_strength=True):
+    """Function to generate the edges of a directed configuration-model graph by random stub
+    matching, keeping only the largest weakly connected component
+    Params
+    sources, targets, weights: edge arrays of the original graph, weights None if unweighted
+    n_nodes: number of nodes
+    seed: optional seed or numpy Generator
+    preserve_strength: if True an edge of integer weight w gives w out-stubs to its source and
+    w in-stubs to its target, the shuffled in-stubs are matched with the out-stubs and the
+    repeated edges merged into weights, so every node keeps its in and out strength exactly.
+    If False the targets of the edges are shuffled, keeping the in and out degrees, and
+    the weights are shuffled among the edges
+
+    returns
+    sources, targets, weights: edge arrays of the component, relabelled from 0
+    component_nodes: array with the original index of each node of the component
+    """
+    rng = np.random.default_rng(seed)
+    if preserve_strength:
+        sources, targets = weight_stubs(sources,targets,weights)
+        targets = targets[rng.permutation(len(targets))]
+        if weights is not None:
+            sources, targets, weights = merge_weight_stubs(sources,targets,n_nodes,directed=True)
+    else:
+        targets = targets[rng.permutation(len(targets))]
+        if weights is not None:
+            weights = weights[rng.permutation(len(weights))]
+    return largest_component_edges(sources,targets,weights,n_nodes)
+
+def weighted_configuration_edges(sources,targets,weights,n_nodes,seed=None,preserve_strength=True):
+    """Function to generate the edges of a weighted undirected configuration-model graph by
+    random stub matching, keeping only the largest connected component
+    Params
+    sources, targets, weights: edge arrays of the original graph, each edge once, weights
+    None if unweighted
+    n_nodes: number of nodes
+    seed: optional seed or numpy Generator
+    preserve_strength: if True an edge of integer weight w gives w stubs to each of its
+    nodes, the shuffled stubs are matched in pairs and the repeated edges merged into
+    weights, so every node keeps its strength exactly. If False the stubs of the edges
+    are matched, keeping the degrees, and the weights are shuffled among the edges
+
+    returns
+    sources, targets, weights: edge arrays of the component, relabelled from 0
+    component_nodes: array with the original index of each node of the component
+    """
+    rng = np.random.default_rng(seed)
+    if preserve_strength:
+        sources, targets = weight_stubs(sources,targets,weights)
+    stubs = np.concatenate([sources,targets])
+    order = rng.permutation(len(stubs))
+    new_sources = stubs[order[0::2]]
+    new_targets = stubs[order[1::2]]
+    if weights is None:
+        new_weights = None
+    elif preserve_strength:
+        new_sources, new_targets, new_weights = merge_weight_stubs(new_sources,new_targets,n_nodes,directed=False)
+    else:
+        new_weights = weights[rng.permutation(len(weights))]
+    return largest_component_edges(new_sources,new_targets,new_weights,n_nodes)
+
+def generate_configuration_graph(degree_sequence,original_sequence,seed=None):
     """Function to generate a configuration graph keeping
     the in and out degree sequence and the strength distribution
     Params
-    G: networkx object of the original graph
+    degree_sequence: degree of each node of the original graph
+    original_sequence: labels of the nodes in the same order as degree_sequence
+    seed: optional seed for the random generator
 
     returns
     G_rand: networkx object with the random graph
     """
+    import networkx as nx
 
-    # Configuration model graph
-    G_config = nx.configuration_model(degree_sequence)
-    new_sequence = [node for node in G_config.nodes()]
-    # Sequence of nodes in the configuration graph
-    # Dictionary with the sequence of nodes
-    node_sequences=my_dict = dict(zip(new_sequence, original_sequence))
-    # THis is a way to have the random graph named as the observed one
-    G_config=nx.relabel_nodes(G_config,node_sequences)
+    sources, targets, component_nodes = configuration_edges(degree_sequence,seed=seed)
 
-    # Keep the largest weakly connected component
-    ccs = nx.connected_components(G_config)
-    gcc = max(ccs, key=len)
-    G_config = G_config.subgraph(gcc)
+    # THis is a way to have the random graph named as the observed one
+    labels = [original_sequence[node] for node in component_nodes]
+    G_config = nx.MultiGraph()
+    G_config.add_nodes_from(labels)
+    G_config.add_edges_from(zip([labels[node] for node in sources],[labels[node] for node in targets]))
     return G_config
 
-def process_graph(G):
+METRIC_NAMES = ("modularity","conductance","ei_index","ei_index_extended")
+
+# Degree and label sequences shared by the null-model workers, set once per process
+_null_model_state={}
+
+def _init_null_model_worker(degree_sequence,original_sequence,partitioner="metis",model=None):
+    _null_model_state["degree_sequence"]=degree_sequence
+    _null_model_state["original_sequence"]=original_sequence
+    _null_model_state["partitioner"]=partitioner
+    _null_model_state["model"]=model
+
+def symmetric_partition(graph,partitioner="metis",seed=None,weighted=False):
+    """Function to partition a graph in two, a directed graph is partitioned as undirected
+    with the weights of both directions added
+    Parameters
+    graph: CSRGraph
+    partitioner: name of the partitioner in partitioners.PARTITIONERS
+    seed: optional seed for the partitioner
+    weighted: if True the edge weights are taken into account
+
+    Returns
+    parts: array with the part of each node in the order of the graph nodes
+    """
+    return partition_graph(symmetric_graph(graph),method=partitioner,seed=seed,weighted=weighted)
+
+def symmetric_graph(graph):
+    """Function to get the undirected version of a CSR graph, with the weights of both directions
+    added and the nodes labelled by their index, or the graph itself if it is undirected"""
+    if not graph.directed:
+        return graph
+    sources, targets, weights = edge_arrays(graph)
+    return csr_from_edges(sources,targets,weights,range(len(graph.nodes)),directed=False)
+
+def weighted_null_model_replicate(seed):
+    """Function to build and score one randomized replicate of a weighted or directed network
+    with the configuration model of _null_model_state["model"]
+    Parameters
+    seed: integer seed of the replicate, used for the configuration model and the partitioner
+
+    Returns
+    metrics: tuple with the polarization metrics in the order given by METRIC_NAMES
+    """
+    model = _null_model_state["model"]
+    sources, targets, weights = model["edges"]
+    configuration = directed_configuration_edges if model["directed"] else weighted_configuration_edges
+    # Without weights the edges are the stubs and the repeated ones are kept as separate edges
+    weights = weights if model["weighted"] else None
+    sources, targets, weights, component_nodes = configuration(sources,targets,weights,model["n_nodes"],seed=seed,
+                                                               preserve_strength=model["preserve_strength"])
+    graph = csr_from_edges(sources,targets,weights,range(len(component_nodes)),directed=model["directed"])
+    parts = symmetric_partition(graph,_null_model_state["partitioner"],seed=seed,weighted=model["weighted"])
+    return contingency_metrics(block_contingency(graph,parts),weighted=model["weighted"])
+
+def null_model_replicate(seed):
+    """Function to build and score one randomized replicate of the network
+    Parameters
+    seed: integer seed of the replicate, used for the configuration model and the partitioner
+
+    Returns
+    metrics: tuple with the polarization metrics in the order given by METRIC_NAMES
+    """
+    if _null_model_state["model"] is not None:
+        return weighted_null_model_replicate(seed)
+    sources, targets, component_nodes = configuration_edges(_null_model_state["degree_sequence"],seed=seed)
+
+    # The metrics do not depend on the labels, the replicate keeps the integer ones
+    graph = csr_from_edges(sources,targets,None,range(len(component_nodes)),directed=False)
+
+    # Partition the replicate once, straight from its arrays
+    parts = partition_graph(graph,method=_null_model_state["partitioner"],seed=seed)
+
+    ### Calculate randomized metrics
+    return contingency_metrics(block_contingency(graph,parts))
+
+def null_model_ensemble(degree_sequence,original_sequence,n_replicates=100,n_workers=1,seed=None,partitioner="metis",
+                        model=None,recorder=NULL_RECORDER):
+    """Generator over the polarization metrics of the randomized replicates.
+    Replicates are spread over a pool of worker processes, each one receives the
+    degree sequence once and only sends back the tuple of metrics
+    Parameters
+    degree_sequence: degree of each node of the original graph
+    original_sequence: labels of the nodes in the same order as degree_sequence
+    n_replicates: number of randomized graphs
+    n_workers: number of worker processes, 1 runs the replicates in this process
+    seed: base seed of the ensemble
+    partitioner: name of the partitioner in partitioners.PARTITIONERS
+    model: optional dictionary for weighted or directed networks, with the edge arrays
+    (sources, targets, weights) of the network under edges, its number of nodes under
+    n_nodes, and the weighted, directed and preserve_strength options. The replicates then
+    come from directed_configuration_edges or weighted_configuration_edges instead of
+    the degree sequence
+    recorder: instrumentation.Recorder receiving one "replicate" record per replicate, measured
+    in the process that computed it
+
+    Yields
+    metrics: tuple with the polarization metrics in the order given by METRIC_NAMES,
+    in replicate order
+    """
+    seeds = replicate_seeds(n_replicates,seed)
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if n_workers <= 1:
+        _init_null_model_worker(degree_sequence,original_sequence,partitioner,model)
+        yield from recorder.map("replicate",null_model_replicate,seeds)
+        return
+
+    chunksize = max(1,n_replicates//(4*n_workers))
+    with multiprocessing.Pool(n_workers,initializer=_init_null_model_worker,
+                              initargs=(degree_sequence,original_sequence,partitioner,model)) as pool:
+        imap = lambda function,arguments: pool.imap(function,arguments,chunksize=chunksize)
+        for metrics in recorder.map("replicate",null_model_replicate,seeds,imap):
+            yield metrics
+
+def process_graph(G,weighted=False,directed=False):
+    """Function to turn the graph into an undirected and unweighted one and keep
+    its largest connected component
+    Parameters
+    G: networkx graph object or CSRGraph
+    weighted: if True repeated edges are merged adding their weights. Otherwise the undirected
+    graph keeps the parallel edges of a multigraph with weight 1, as networkx to_undirected
+    directed: if True a directed graph keeps the direction of its edges, and its largest
+    weakly connected component is kept
+
+    Returns
+    G: processed graph of the same type, a CSRGraph when weighted or directed
+    """
+    if weighted or directed:
+        graph = as_csr(G)
+        directed = directed and graph.directed
+        n_nodes = len(graph.nodes)
+        sources, targets, weights = edge_arrays(graph)
+        if not directed:
+            sources, targets = np.minimum(sources,targets), np.maximum(sources,targets)
+
+        # One edge per pair of nodes, with the total weight of the repeated edges
+        pair_keys, pair_index = np.unique(sources.astype(np.int64)*n_nodes+targets,return_inverse=True)
+        sources, targets = np.divmod(pair_keys,n_nodes)
+        weights = np.bincount(pair_index,weights=weights,minlength=len(pair_keys)) if weighted else None
+
+        sources, targets, weights, component_nodes = largest_component_edges(sources,targets,weights,n_nodes)
+        return csr_from_edges(sources,targets,weights,[graph.nodes[node] for node in component_nodes],directed=directed)
+
+    if isinstance(G, CSRGraph):
+        graph = G
+        n_nodes = len(graph.nodes)
+        sources, targets, _ = edge_arrays(graph)
+
+        # Undirected graph as networkx to_undirected: the parallel edges of a multigraph are kept,
+        # and the edges in both directions of a pair are merged key by key, so the pair keeps
+        # as many edges as its most repeated direction
+        lower = np.minimum(sources,targets).astype(np.int64)
+        upper = np.maximum(sources,targets).astype(np.int64)
+        pair_keys, pair_index = np.unique(lower*n_nodes+upper,return_inverse=True)
+        if graph.directed:
+            forward = sources <= targets
+            multiplicity = np.maximum(np.bincount(pair_index[forward],minlength=len(pair_keys)),
+                                      np.bincount(pair_index[~forward],minlength=len(pair_keys)))
+        else:
+            multiplicity = np.bincount(pair_index,minlength=len(pair_keys))
+        sources, targets = np.divmod(np.repeat(pair_keys,multiplicity),n_nodes)
+
+        sources, targets, component_nodes = largest_component(sources,targets,n_nodes)
+        ### All weights equal to 1
+        return csr_from_edges(sources,targets,None,[graph.nodes[node] for node in component_nodes],directed=False)
+
+    import networkx as nx
 
     G=G.to_undirected()
 
@@ -162,29 +532,49 @@ def process_graph(G):
     return G
 # Define paths
 
-def main(network_file):
-
-
-    ## Read graph
-    G = nx.read_gml(f"{network_file}")
-    G=process_graph(G)
-
-    degree_sequence = [val[1] for val in G.degree]
-    original_sequence = [node for node in G.nodes()]
-
-    ### Create metis graph
-    metis_graph=metis.networkx_to_metis(G)
-    ### Get metis partition
-    partition_array=metis.part_graph(metis_graph)
+def run_polarization(G,n_replicates=100,n_workers=1,seed=None,tolerance=None,min_replicates=20,
+                     keep_replicates=False,on_replicate=None,partitioner="metis",recorder=NULL_RECORDER,
+                     weighted=False,directed=False,preserve_strength=True):
+    """Function to calculate the polarization metrics of the real network
+    and of an ensemble of randomized configuration-model graphs
+    Parameters
+    G: network, CSRGraph or networkx graph object
+    n_replicates: maximum number of randomized graphs
+    n_workers: number of worker processes used for the randomized graphs
+    seed: base seed of the randomized ensemble
+    tolerance: if given, the ensemble stops once the 95% confidence interval of every
+    z-score has a half-width below tolerance*max(1,|z|), metrics whose randomized values
+    do not vary are taken as resolved
+    min_replicates: minimum number of randomized graphs before the ensemble can stop
+    keep_replicates: if True the metrics of every randomized graph are also returned
+    on_replicate: optional function called after every replicate with the number of
+    replicates and the dictionary of current statistics
+    partitioner: name of the partitioner in partitioners.PARTITIONERS used for the real
+    network and every randomized graph
+    recorder: optional instrumentation.Recorder of the preprocess, partition, metrics
+    and replicate stages
+    weighted: if True the repeated edges are merged into weights, used by the partitioner,
+    modularity and conductance, and the randomized graphs keep the strengths
+    directed: if True a directed network keeps its directions, the metrics are the directed
+    ones and the randomized graphs keep the in and out degree of every node
+    preserve_strength: for weighted networks, if True the randomized graphs match one stub per
+    unit of weight and keep the in and out strength of every node exactly, which needs integer
+    weights, otherwise they keep the degrees and the weights are shuffled among the edges
+
+    Returns
+    summary_polarization: dictionary with the real metrics and the statistics of the randomized ones
+    """
+    with recorder.stage("preprocess") as stage:
+        graph = process_graph(as_csr(G),weighted=weighted,directed=directed)
+        stage["items"] = len(graph.nodes)
 
-    ## Calculate integer graph that corresponds to the metis graph
-    H = nx.convert_node_labels_to_integers(G,label_attribute='old_label')
+    degree_sequence = degrees(graph)
+    original_sequence = graph.nodes
 
-    ### Get module dictionary using the old labels
-    modules={}
-    for node in H.nodes():
-        label_node = H.nodes[node]["old_label"]
-        modules[label_node]=partition_array[1][node]
+    ### Get the partition straight from the arrays of the graph
+    with recorder.stage("partition",partitioner=partitioner) as stage:
+        modules = nodes_dict(graph,symmetric_partition(graph,partitioner,weighted=weighted))
+        stage["items"] = len(modules)
 
     ### Calculate partition array need for some metrics
     partition_array=[[],[]]
@@ -192,40 +582,213 @@ def main(network_file):
         partition_array[modules[node]].append(node)
 
     ## Calculate polarization metrics
-    polarization_measures=calculate_polarization_metrics(G,partition_array,modules)
+    with recorder.stage("metrics") as stage:
+        polarization_measures=calculate_polarization_metrics(graph,partition_array,modules,weighted=weighted)
+        stage["items"] = len(graph.indices)
 
     summary_polarization={}
     summary_polarization["real"]={}
     for key in polarization_measures:
         summary_polarization["real"][key] = polarization_measures[key]
 
-    del G
-
-    summary_polarization["random"]={}
-
-    for i in range(0,100):
-        ## Create random graph with degree sequence
-        G_temporal = generate_configuration_graph(degree_sequence,original_sequence)
-
-        # Set all weights to 0
-        for (u, v, d) in G_temporal.edges(data=True):
-            d['weight'] = 1
-        ## Create metis graphs
-        metis_graph = metis.networkx_to_metis(G_temporal)
-        ## Get metis partition
-        partition = metis.part_graph(metis_graph)
-        H = nx.convert_node_labels_to_integers(G_temporal,label_attribute='old_label')
-
-
-        # Calculate partitions
-        community_metis, partition_array = two_communities_partition(G_temporal)
-
-        ### Calculate randomized metrics
-        polarization_measures=calculate_polarization_metrics(G_temporal,partition_array,community_metis)
-        for metric in polarization_measures:
-            summary_polarization["random"][metric]=summary_polarization["random"].setdefault(metric,[])
-            summary_polarization["random"][metric].append(polarization_measures[metric])
+    model = None
+    if weighted or graph.directed:
+        # The randomized graphs are drawn from the edges instead of the degree sequence
+        model = {"edges":edge_arrays(graph),"n_nodes":len(graph.nodes),"weighted":weighted,
+                 "directed":graph.directed,"preserve_strength":preserve_strength}
+
+    del graph
+
+    statistics={metric:OnlineStatistics(summary_polarization["real"][metric]) for metric in METRIC_NAMES}
+    replicates={metric:[] for metric in METRIC_NAMES}
+
+    ensemble=null_model_ensemble(degree_sequence,original_sequence,
+                                 n_replicates=n_replicates,n_workers=n_workers,seed=seed,
+                                 partitioner=partitioner,model=model,recorder=recorder)
+    for metrics in ensemble:
+        for metric,value in zip(METRIC_NAMES,metrics):
+            statistics[metric].update(value)
+            if keep_replicates:
+                replicates[metric].append(value)
+        if on_replicate is not None:
+            on_replicate(statistics[METRIC_NAMES[0]].n,{metric:statistics[metric].summary() for metric in METRIC_NAMES})
+        if tolerance is not None and converged(statistics,tolerance,min_replicates):
+            break
+    # Stops the workers if the ensemble finished early
+    ensemble.close()
+
+    summary_polarization["random"]={metric:statistics[metric].summary() for metric in METRIC_NAMES}
+    if keep_replicates:
+        summary_polarization["replicates"]=replicates
+
+    return summary_polarization
+
+# Metrics of the partitions of the sweep, all of them defined for any number of parts
+SWEEP_METRIC_NAMES = ("modularity","ei_index","ei_index_extended")
+
+# Edge arrays and METIS adjacency shared by the sweep workers, set once per process
+_sweep_state={}
+
+def _init_sweep_worker(state):
+    _sweep_state.update(state)
+    # The METIS graph is a set of ctypes views that cannot be sent to the workers, each one wraps the arrays once
+    _sweep_state["metis_graph"]=metis_graph_from_arrays(state["xadj"],state["adjncy"],state["adjwgt"])
+
+def sweep_partition(task):
+    """Function to partition the graph of the sweep with METIS and score the partition
+    Parameters
+    task: tuple with the number of parts and the METIS seed
+
+    Returns
+    result: dictionary with the number of parts, the seed, the size of each part and the
+    metrics of SWEEP_METRIC_NAMES
+    """
+    n_parts,seed=task
+    state=_sweep_state
+    parts=metis_part_graph(state["metis_graph"],nparts=n_parts,seed=seed)
+    contingency=edge_contingency(state["sources"],state["targets"],state["weights"],parts,n_parts,state["directed"])
+    result={"n_parts":n_parts,"seed":seed,"block_sizes":contingency["block_sizes"].tolist()}
+    with np.errstate(divide="ignore",invalid="ignore"):
+        result["modularity"]=contingency_modularity(contingency,weighted=state["weighted"])
+        result["ei_index"]=contingency_ei_index(contingency)
+        result["ei_index_extended"]=contingency_extended_ei_index(contingency)
+    return result
+
+def summarize_sweep(partitions):
+    """Function to summarize the metrics of the partitions of a sweep over their seeds
+    Parameters
+    partitions: list of results of sweep_partition
+
+    Returns
+    summary: dictionary with the number of parts as keys and, for each metric, a dictionary
+    with the mean, standard deviation, minimum and maximum over the seeds
+    """
+    summary={}
+    for n_parts in sorted({result["n_parts"] for result in partitions}):
+        results=[result for result in partitions if result["n_parts"]==n_parts]
+        summary[n_parts]={}
+        for metric in SWEEP_METRIC_NAMES:
+            values=np.array([result[metric] for result in results],dtype=np.float64)
+            # Metrics undefined for a partition, e.g. with an empty part, are left out
+            values=values[~np.isnan(values)]
+            if len(values)==0:
+                summary[n_parts][metric]=dict.fromkeys(("mean","std","min","max"),float("nan"))
+                continue
+            summary[n_parts][metric]={"mean":float(values.mean())
+                                      ,"std":float(values.std(ddof=1)) if len(values)>1 else float("nan")
+                                      ,"min":float(values.min())
+                                      ,"max":float(values.max())}
+    return summary
+
+def partition_sweep(G,n_parts=range(2,17),n_seeds=5,seed=None,n_workers=1,weighted=False,directed=False,
+                    recorder=NULL_RECORDER):
+    """Function to test the robustness of the polarization metrics splitting the network in a
+    range of numbers of parts with several METIS seeds each. The network is processed and its
+    METIS adjacency built only once, and the partitions are spread over a pool of workers that
+    receive them once and only send back the metrics
+    Parameters
+    G: network, CSRGraph or networkx graph object
+    n_parts: iterable with the numbers of parts
+    n_seeds: number of METIS seeds per number of parts
+    seed: base seed from which the METIS seeds are derived
+    n_workers: number of worker processes, 1 runs the partitions in this process
+    weighted: if True the repeated edges are merged into weights, used by METIS and modularity
+    directed: if True a directed network keeps its directions for the metrics, METIS splits
+    its undirected version
+    recorder: optional instrumentation.Recorder of the preprocess, METIS arrays and partition stages
+
+    Returns
+    sweep: dictionary with the list of partitions, each one as returned by sweep_partition,
+    and their summary by number of parts from summarize_sweep
+    """
+    with recorder.stage("preprocess") as stage:
+        graph = process_graph(as_csr(G),weighted=weighted,directed=directed)
+        stage["items"] = len(graph.nodes)
+
+    with recorder.stage("metis_arrays") as stage:
+        xadj,adjncy,adjwgt = metis_arrays_from_csr(symmetric_graph(graph),weighted=weighted)
+        sources,targets,weights = edge_arrays(graph)
+        stage["items"] = len(adjncy)
+    state={"xadj":xadj,"adjncy":adjncy,"adjwgt":adjwgt,"sources":sources,"targets":targets,"weights":weights,
+           "directed":graph.directed,"weighted":weighted}
+    del graph
+
+    seeds = replicate_seeds(n_seeds,seed)
+    tasks = [(int(k),partition_seed) for k in n_parts for partition_seed in seeds]
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if n_workers <= 1:
+        _init_sweep_worker(state)
+        partitions = list(recorder.map("sweep_partition",sweep_partition,tasks))
+    else:
+        chunksize = max(1,len(tasks)//(4*n_workers))
+        with multiprocessing.Pool(n_workers,initializer=_init_sweep_worker,initargs=(state,)) as pool:
+            imap = lambda function,arguments: pool.imap(function,arguments,chunksize=chunksize)
+            partitions = list(recorder.map("sweep_partition",sweep_partition,tasks,imap))
+
+    return {"partitions":partitions,"summary":summarize_sweep(partitions)}
+
+def main(network_file,n_replicates=100,n_workers=1,seed=None,tolerance=None,min_replicates=20,
+         keep_replicates=False,on_replicate=None,cache_dir=None,partitioner="metis",recorder=NULL_RECORDER,
+         weighted=False,directed=False,preserve_strength=True):
+    """Function to read a network and calculate its polarization metrics, see run_polarization
+    Parameters
+    network_file: gml file with the network
+    cache_dir: directory of the binary graph cache, by default .graph_cache next to the network file
+    The rest of parameters are those of run_polarization
+
+    Returns
+    summary_polarization: dictionary with the real metrics and the statistics of the randomized ones
+    """
+    ## Read graph
+    with recorder.stage("load") as stage:
+        graph = load_graph(network_file,cache_dir=cache_dir)
+        stage["items"] = len(graph.nodes)
 
+    return run_polarization(graph,n_replicates=n_replicates,n_workers=n_workers,seed=seed,
+                            tolerance=tolerance,min_replicates=min_replicates,
+                            keep_replicates=keep_replicates,on_replicate=on_replicate,
+                            partitioner=partitioner,recorder=recorder,weighted=weighted,
+                            directed=directed,preserve_strength=preserve_strength)
 
 if __name__ == '__main__':
-    main(sys.argv[1])
+    parser = argparse.ArgumentParser(description="Polarization metrics of a network and its randomized ensemble")
+    parser.add_argument("network_file")
+    parser.add_argument("--replicates",type=int,default=100,help="maximum number of randomized graphs")
+    parser.add_argument("--workers",type=int,default=1,help="number of worker processes for the randomized graphs")
+    parser.add_argument("--seed",type=int,default=None,help="base seed of the randomized ensemble")
+    parser.add_argument("--tolerance",type=float,default=None,
+                        help="stop once the confidence interval of every z-score has a half-width below this value, "
+                             "relative to |z| when |z| is above 1")
+    parser.add_argument("--min-replicates",type=int,default=20,help="minimum number of randomized graphs before stopping")
+    parser.add_argument("--cache-dir",default=None,help="directory of the binary graph cache")
+    parser.add_argument("--partitioner",default="metis",choices=sorted(PARTITIONERS),
+                        help="method used to split the network in two communities")
+    parser.add_argument("--weighted",action="store_true",
+                        help="merge repeated edges into weights instead of keeping them once")
+    parser.add_argument("--directed",action="store_true",help="keep the direction of the edges")
+    parser.add_argument("--shuffle-weights",action="store_true",
+                        help="keep the degrees of the randomized graphs and shuffle their weights, "
+                             "instead of keeping the strengths by matching one stub per unit of weight")
+    parser.add_argument("--log-file",default=None,help="jsonl file where the time and memory of every stage are appended")
+    parser.add_argument("--progress",action="store_true",help="report every stage on the standard error")
+    parser.add_argument("--sweep",type=int,nargs=2,default=None,metavar=("MIN_PARTS","MAX_PARTS"),
+                        help="instead of the randomized ensemble, split the network with METIS in every number of parts "
+                             "of this range and print the metrics of each partition as json")
+    parser.add_argument("--sweep-seeds",type=int,default=5,help="number of METIS seeds per number of parts of the sweep")
+    args = parser.parse_args()
+    recorder = NULL_RECORDER
+    if args.log_file is not None or args.progress:
+        recorder = Recorder(log_file=args.log_file,progress=print_progress if args.progress else None)
+    if args.sweep is not None:
+        graph = load_graph(args.network_file,cache_dir=args.cache_dir)
+        sweep = partition_sweep(graph,n_parts=range(args.sweep[0],args.sweep[1]+1),n_seeds=args.sweep_seeds,
+                                seed=args.seed,n_workers=args.workers,weighted=args.weighted,directed=args.directed,
+                                recorder=recorder)
+        print(json.dumps(sweep))
+    else:
+        main(args.network_file,n_replicates=args.replicates,n_workers=args.workers,seed=args.seed,
+             tolerance=args.tolerance,min_replicates=args.min_replicates,cache_dir=args.cache_dir,
+             partitioner=args.partitioner,recorder=recorder,weighted=args.weighted,directed=args.directed,
+             preserve_strength=not args.shuffle_weights)
+    recorder.close()
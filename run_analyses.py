@@ -0,0 +1,99 @@
+import sys
+import json
+from graph_cache import load_graph
+from graph_arrays import as_csr
+from edge_store import EdgeStore
+from communities import as_assignment
+from instrumentation import NULL_RECORDER, Recorder, print_progress
+
+ANALYSES = ("polarization", "entropy", "chamber")
+
+
+def run_analyses(config, G=None, modules=None, recorder=None):
+    """Function to run several analyses on one network, reading the network and the
+    communities only once
+    Parameters
+    config: dictionary with the configuration, with the fields
+        path: path to the input files
+        network_file: name of the gml file with the network
+        community_file: name of the json file with the community of each node,
+        only needed by the entropy and chamber analyses
+        analyses: list of analyses to run among polarization, entropy and chamber
+        polarization: optional dictionary with the parameters of polarization.run_polarization
+        entropy_null_model: optional dictionary with the parameters of entropy.community_null_model
+        relevant_communities, number_of_top_users, approximate_overlap: parameters of the chamber analysis
+        cache_dir: optional directory of the binary graph cache
+        log_file: optional jsonl file where the time and memory of every stage are appended
+        progress: if true every stage is reported on the standard error
+        output_file: file where main writes the combined results, results.json by default
+    G: optional network already loaded
+    modules: optional community dictionary or CommunityAssignment already loaded
+    recorder: optional instrumentation.Recorder, by default one is created if the
+    configuration has a log_file or progress
+
+    Returns
+    results: dictionary with the analyses as keys and their results as values, plus
+    the totals of every stage under profile when the stages are recorded
+    """
+    analyses = config.get("analyses", list(ANALYSES))
+    for analysis in analyses:
+        if analysis not in ANALYSES:
+            raise ValueError(f"Unknown analysis {analysis}, the available ones are {', '.join(ANALYSES)}")
+
+    own_recorder = recorder is None
+    if recorder is None:
+        recorder = NULL_RECORDER
+        if config.get("log_file") is not None or config.get("progress"):
+            recorder = Recorder(log_file=config.get("log_file"),
+                                progress=print_progress if config.get("progress") else None)
+
+    FILE_PATH = config.get("path", "")
+    if G is None:
+        with recorder.stage("load") as stage:
+            G = load_graph(f"{FILE_PATH}{config['network_file']}", cache_dir=config.get("cache_dir"))
+            stage["items"] = len(G.nodes)
+    if modules is None and ("entropy" in analyses or "chamber" in analyses):
+        with open(f"{FILE_PATH}{config['community_file']}", 'r') as f:
+            modules = json.load(f)
+    # Encode the graph and the communities once for all the analyses
+    if not isinstance(G, EdgeStore):
+        G = as_csr(G)
+    if modules is not None:
+        modules = as_assignment(G, modules)
+
+    results = {}
+    # The analysis modules are imported only when they are requested
+    if "polarization" in analyses:
+        from polarization import run_polarization
+        with recorder.stage("run_polarization"):
+            results["polarization"] = run_polarization(G, recorder=recorder, **config.get("polarization", {}))
+    if "entropy" in analyses:
+        from entropy import run_entropy
+        with recorder.stage("run_entropy"):
+            results["entropy"] = run_entropy(G, modules, null_model=config.get("entropy_null_model"), recorder=recorder)
+    if "chamber" in analyses:
+        from chamber_analysis import run_chamber
+        with recorder.stage("run_chamber"):
+            results["chamber"] = run_chamber(G, modules, config["relevant_communities"], config["number_of_top_users"],
+                                             approximate_overlap=config.get("approximate_overlap"), recorder=recorder)
+    if recorder.enabled:
+        results["profile"] = recorder.summary()
+    if own_recorder:
+        recorder.close()
+    return results
+
+
+def main(config_file):
+    # Read configuration file
+    with open(config_file, 'r') as f:
+        config = json.load(f)
+
+    results = run_analyses(config)
+
+    with open(config.get("output_file", "results.json"), 'w') as f:
+        json.dump(results, f, indent=1)
+    return results
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
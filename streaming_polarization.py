@@ -0,0 +1,225 @@
+import sys
+import json
+import argparse
+from collections import deque
+from datetime import datetime
+import numpy as np
+from graph_arrays import csr_from_edges
+from partitioners import metis_partition
+from polarization import METRIC_NAMES, contingency_metrics
+
+
+def parse_time(value):
+    """Function to read a timestamp as seconds, either a number or an ISO 8601 date"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def read_events(f, delimiter=None):
+    """Function to read timestamped edge events, one per line as
+    timestamp source target [weight], sorted by timestamp
+    Parameters
+    f: open text file, e.g. sys.stdin
+    delimiter: separator of the fields, any whitespace by default
+
+    Returns
+    events: generator of (time, source, target, weight) tuples
+    """
+    for line in f:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        fields = line.split(delimiter)
+        weight = float(fields[3]) if len(fields) > 3 else 1.0
+        yield parse_time(fields[0]), fields[1].strip(), fields[2].strip(), weight
+
+
+class WindowContingency:
+    """Block contingency of the edges of a sliding window, updated edge by edge.
+    Holds the same counters as polarization.block_contingency for a fixed two block
+    partition, so adding or removing an edge costs O(1)
+    Parameters
+    partition: dictionary with nodes as keys and the block (0 or 1) as value
+    directed: if False the edges are taken as undirected
+    """
+
+    def __init__(self, partition=None, directed=True):
+        self.partition = dict(partition or {})
+        self.directed = directed
+        self.edge_counts = np.zeros((2, 2), dtype=np.int64)
+        self.edge_weights = np.zeros((2, 2), dtype=np.float64)
+        self.block_sizes = np.zeros(2, dtype=np.int64)
+        # Number of window edges of each node, a node belongs to the window while it has some
+        self.node_degree = {}
+
+    def block(self, node, neighbour):
+        """Block of a node, nodes outside the partition join the block of the other end
+        of their first edge or, if it is new too, the smallest block"""
+        if node not in self.partition:
+            if neighbour in self.partition:
+                self.partition[node] = self.partition[neighbour]
+            else:
+                self.partition[node] = int(np.argmin(self.block_sizes))
+        return self.partition[node]
+
+    def _count_node(self, node, block, change):
+        degree = self.node_degree.get(node, 0) + change
+        if degree == 0:
+            del self.node_degree[node]
+            self.block_sizes[block] -= 1
+        else:
+            if degree == change:
+                self.block_sizes[block] += 1
+            self.node_degree[node] = degree
+
+    def update(self, source, target, weight, change=1):
+        """Function to add (change=1) or remove (change=-1) one edge of the window"""
+        block_source = self.block(source, target)
+        block_target = self.block(target, source)
+        self.edge_counts[block_source, block_target] += change
+        self.edge_weights[block_source, block_target] += change*weight
+        self._count_node(source, block_source, change)
+        if target != source:
+            self._count_node(target, block_target, change)
+
+    def repartition(self, partition, events):
+        """Function to change the partition and recount the edges of the window
+        Parameters
+        partition: dictionary with nodes as keys and the new block as value
+        events: the (time, source, target, weight) events of the window
+        """
+        self.__init__(partition, self.directed)
+        for _, source, target, weight in events:
+            self.update(source, target, weight)
+
+    def contingency(self):
+        """Current counters in the format of polarization.block_contingency"""
+        return {"edge_counts": self.edge_counts.copy()
+                , "edge_weights": self.edge_weights.copy()
+                , "block_sizes": self.block_sizes.copy()
+                , "directed": self.directed}
+
+    def metrics(self):
+        """Polarization metrics of the current window as polarization.calculate_polarization_metrics,
+        nan when undefined"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return dict(zip(METRIC_NAMES, contingency_metrics(self.contingency())))
+
+
+def window_partition(events, seed=None):
+    """Function to split the nodes of the window in two blocks with METIS, on the
+    undirected and unweighted graph of its edges as in polarization.process_graph
+    Parameters
+    events: the (time, source, target, weight) events of the window
+    seed: optional seed for the METIS partitioner
+
+    Returns
+    partition: dictionary with nodes as keys and the block as value
+    """
+    node_index = {}
+    sources = []
+    targets = []
+    for _, source, target, _ in events:
+        sources.append(node_index.setdefault(source, len(node_index)))
+        targets.append(node_index.setdefault(target, len(node_index)))
+    if len(node_index) < 2:
+        return {node: 0 for node in node_index}
+    graph = csr_from_edges(np.array(sources), np.array(targets), None, list(node_index), directed=False)
+    parts = metis_partition(graph, nparts=2, seed=seed)
+    return dict(zip(node_index, parts.tolist()))
+
+
+def stream_polarization(events, window, step, repartition_every=24, partition=None, directed=True, seed=None):
+    """Function to calculate the polarization metrics over sliding windows of a stream of edges.
+    Each window only adds the events that enter it and removes the ones that leave it,
+    the partition is held fixed between repartitions
+    Parameters
+    events: iterable of (time, source, target, weight) tuples sorted by time
+    window: length of the windows, in the units of the timestamps
+    step: time between the ends of consecutive windows
+    repartition_every: number of windows between METIS repartitions, None or 0 keeps
+    the initial partition for the whole stream
+    partition: optional initial dictionary with nodes as keys and the block as value,
+    by default the first window is partitioned with METIS
+    directed: if False the edges are taken as undirected
+    seed: optional seed for the METIS partitioner
+
+    Returns
+    windows: generator of dictionaries with the start and end of the window, its number of
+    edges and nodes, whether it was repartitioned, and the polarization metrics
+    """
+    counters = WindowContingency(partition, directed)
+    in_window = deque()
+    events = iter(events)
+    pending = next(events, None)
+    if pending is None:
+        return
+    end = pending[0] + window
+    n_windows = 0
+
+    while True:
+        # Edges entering the window
+        while pending is not None and pending[0] < end:
+            if in_window and pending[0] < in_window[-1][0]:
+                raise ValueError(f"Events are not sorted by time at {pending[0]}")
+            in_window.append(pending)
+            counters.update(pending[1], pending[2], pending[3])
+            pending = next(events, None)
+        # Edges leaving the window
+        while in_window and in_window[0][0] < end - window:
+            _, source, target, weight = in_window.popleft()
+            counters.update(source, target, weight, change=-1)
+
+        repartitioned = False
+        if (partition is None and n_windows == 0) or (repartition_every and n_windows > 0
+                                                      and n_windows % repartition_every == 0):
+            counters.repartition(window_partition(in_window, seed=seed), in_window)
+            repartitioned = True
+
+        window_metrics = {"start": end - window, "end": end, "n_edges": len(in_window),
+                          "n_nodes": len(counters.node_degree), "repartitioned": repartitioned}
+        window_metrics.update(counters.metrics())
+        yield window_metrics
+        n_windows += 1
+
+        if pending is None and (not in_window or in_window[-1][0] < end - window + step):
+            # The next window would not hold any new edge
+            return
+        end += step
+
+
+def main(event_file, window, step, repartition_every=24, partition_file=None, directed=True, seed=None,
+         delimiter=None):
+    partition = None
+    if partition_file is not None:
+        with open(partition_file, 'r') as f:
+            partition = json.load(f)
+
+    f = sys.stdin if event_file == "-" else open(event_file, 'r')
+    try:
+        for window_metrics in stream_polarization(read_events(f, delimiter), window, step,
+                                                  repartition_every=repartition_every, partition=partition,
+                                                  directed=directed, seed=seed):
+            print(json.dumps(window_metrics), flush=True)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Polarization metrics over sliding windows of timestamped edge events")
+    parser.add_argument("event_file", help="file with one 'timestamp source target [weight]' event per line, - for stdin")
+    parser.add_argument("--window", type=float, default=86400, help="length of the windows in seconds")
+    parser.add_argument("--step", type=float, default=3600, help="time between consecutive windows in seconds")
+    parser.add_argument("--repartition-every", type=int, default=24,
+                        help="number of windows between METIS repartitions, 0 keeps the first partition")
+    parser.add_argument("--partition", default=None,
+                        help="json file with the initial block of each node, by default the first window is partitioned")
+    parser.add_argument("--undirected", action="store_true", help="take the edges as undirected")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the METIS partitioner")
+    parser.add_argument("--delimiter", default=None, help="field separator, any whitespace by default")
+    args = parser.parse_args()
+    main(args.event_file, args.window, args.step, repartition_every=args.repartition_every,
+         partition_file=args.partition, directed=not args.undirected, seed=args.seed, delimiter=args.delimiter)